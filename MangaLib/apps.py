@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MangalibConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'MangaLib'
+
+    def ready(self):
+        # Подключаем обработчики сигналов (счётчики закладок и избранного)
+        from . import signals  # noqa: F401
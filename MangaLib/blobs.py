@@ -0,0 +1,125 @@
+import os
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from .images import delete_variants
+from .media import PAGE_BLOB_DIR
+from .models import MangaPage, PageBlob
+
+BLOB_EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+}
+
+
+def blob_name(sha256, fmt):
+    # Два уровня каталогов по префиксу хеша, чтобы в одной папке не было миллионов файлов
+    return f'{PAGE_BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}.{BLOB_EXTENSIONS[fmt]}'
+
+
+def blob_path(name):
+    return os.path.join(settings.MEDIA_ROOT, name)
+
+
+def acquire_blobs(results):
+    # results: PageResult для каждой страницы. Создаёт недостающие блобы, блокирует все
+    # нужные строки и увеличивает refcount на число ссылок. Вызывается внутри транзакции.
+    # Возвращает {sha256: PageBlob}.
+    references = Counter(result.sha256 for result in results)
+    by_sha256 = {result.sha256: result for result in results}
+    blobs = {}
+    missing = set(references)
+    while missing:
+        PageBlob.objects.bulk_create(
+            [
+                PageBlob(
+                    sha256=sha256, image=blob_name(sha256, by_sha256[sha256].format),
+                    file_size=by_sha256[sha256].file_size,
+                    width=by_sha256[sha256].width, height=by_sha256[sha256].height,
+                )
+                for sha256 in missing
+            ],
+            ignore_conflicts=True,
+        )
+        # Конфликт вставки означает, что строка уже есть, но её мог заблокировать
+        # collect_unreferenced_blobs (refcount=0). После его коммита строки нет, и
+        # SELECT FOR UPDATE её не вернёт: вставляем такие блобы заново, пока не получим все
+        blobs.update(
+            (blob.sha256, blob)
+            for blob in PageBlob.objects.select_for_update().filter(sha256__in=missing)
+        )
+        missing -= blobs.keys()
+
+    change_refcounts({blobs[sha256].pk: count for sha256, count in references.items()})
+    return blobs
+
+
+def change_refcounts(counts, sign=1):
+    # counts: {id блоба: число ссылок}. Один UPDATE на каждую кратность; обычно это один запрос
+    by_count = {}
+    for blob_id, count in counts.items():
+        by_count.setdefault(count, []).append(blob_id)
+    for count, ids in by_count.items():
+        PageBlob.objects.filter(pk__in=ids).update(refcount=F('refcount') + sign * count)
+
+
+def release_blob(blob_id, count=1):
+    if blob_id is not None:
+        PageBlob.objects.filter(pk=blob_id).update(refcount=F('refcount') - count)
+
+
+def release_blobs(blob_ids):
+    change_refcounts(Counter(blob_id for blob_id in blob_ids if blob_id is not None), sign=-1)
+
+
+def delete_blob_files(blobs):
+    # Вызывается после коммита удаления строк. Файл сначала убираем в сторону и только потом
+    # проверяем, не создала ли загрузка главы строку с тем же хешем заново: её publish()
+    # либо уже нашёл файл на месте (тогда строка видна, и файл возвращается обратно),
+    # либо увидит, что файла нет, и положит свой
+    moved = {}
+    for blob in blobs:
+        path = blob_path(blob.image.name)
+        trash_path = f'{path}.{uuid.uuid4().hex}.deleted'
+        try:
+            os.replace(path, trash_path)
+        except FileNotFoundError:
+            continue
+        moved[blob.sha256] = (path, trash_path)
+
+    recreated = set(
+        PageBlob.objects.filter(sha256__in=[blob.sha256 for blob in blobs]).values_list('sha256', flat=True)
+    )
+    for blob in blobs:
+        if blob.sha256 not in recreated:
+            delete_variants(blob.image.name)
+        if blob.sha256 not in moved:
+            continue
+        path, trash_path = moved[blob.sha256]
+        if blob.sha256 in recreated and not os.path.exists(path):
+            os.replace(trash_path, path)
+        else:
+            os.remove(trash_path)
+
+
+def collect_unreferenced_blobs(limit=1000):
+    # Удаляет блобы без ссылок вместе с файлами и уменьшенными копиями. Строки, которые
+    # прямо сейчас использует загрузка главы, заблокированы и пропускаются. Загрузка, которая
+    # ждёт строку, заблокированную здесь, после коммита создаст её заново (acquire_blobs).
+    # Файлы удаляются только после коммита: при откате строки и файлы остаются на месте
+    with transaction.atomic():
+        blobs = list(
+            PageBlob.objects
+            .select_for_update(skip_locked=True)
+            .filter(refcount=0)
+            .exclude(Exists(MangaPage.objects.filter(blob=OuterRef('pk'))))
+            .order_by('id')[:limit]
+        )
+        PageBlob.objects.filter(pk__in=[blob.pk for blob in blobs]).delete()
+        transaction.on_commit(lambda: delete_blob_files(blobs))
+    return len(blobs)
@@ -0,0 +1,52 @@
+from django.db import transaction
+
+from .counters import MANGA_COUNTER_FIELDS, change_manga_counter
+from .models import Manga, User
+
+# Прямая работа с таблицей связей, минуя менеджер m2m: сигналы m2m_changed не отправляются,
+# поэтому счётчики на Manga обновляются здесь же, в той же транзакции.
+# Строка пользователя блокируется, чтобы параллельные запросы одного пользователя
+# не посчитали одну и ту же связь дважды.
+Bookmark = User.bookmarks.through
+
+
+def lock_user(user):
+    list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+
+
+def toggle_bookmark(user, manga_id):
+    # Возвращает True, если закладка добавлена, и False, если удалена
+    field = MANGA_COUNTER_FIELDS[Bookmark]
+    with transaction.atomic():
+        lock_user(user)
+        links = Bookmark.objects.filter(user_id=user.pk, manga_id=manga_id)
+        if links.exists():
+            links.delete()
+            change_manga_counter(field, [manga_id], -1)
+            return False
+        Bookmark.objects.create(user_id=user.pk, manga_id=manga_id)
+        change_manga_counter(field, [manga_id], 1)
+        return True
+
+
+def change_bookmarks(user, add_ids=(), remove_ids=()):
+    # Пакетное добавление и удаление: один INSERT, один DELETE и по UPDATE на счётчики.
+    # Несуществующие id и уже выполненные изменения пропускаются.
+    field = MANGA_COUNTER_FIELDS[Bookmark]
+    add_ids, remove_ids = set(add_ids), set(remove_ids)
+    with transaction.atomic():
+        lock_user(user)
+        current = set(
+            Bookmark.objects
+            .filter(user_id=user.pk, manga_id__in=add_ids | remove_ids)
+            .values_list('manga_id', flat=True)
+        )
+
+        added = set(Manga.objects.filter(pk__in=add_ids - current).values_list('pk', flat=True))
+        Bookmark.objects.bulk_create([Bookmark(user_id=user.pk, manga_id=manga_id) for manga_id in added])
+        change_manga_counter(field, added, 1)
+
+        removed = remove_ids & current
+        Bookmark.objects.filter(user_id=user.pk, manga_id__in=removed).delete()
+        change_manga_counter(field, removed, -1)
+    return sorted(added), sorted(removed)
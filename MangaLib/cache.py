@@ -0,0 +1,77 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import CatalogVersion
+
+
+# Глобальная версия каталога: входит в ключ каждого закешированного ответа,
+# поэтому после bump_catalog_version() старые записи просто перестают читаться.
+# Сама версия лежит в одной строке БД, общей для всех процессов
+CATALOG_VERSION_ID = 1
+FEED_HITS_KEY = 'mangalib:feed_cache:hits'
+FEED_MISSES_KEY = 'mangalib:feed_cache:misses'
+
+
+def _increment(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+        return 1
+
+
+def _catalog_version():
+    return CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).values_list('version', flat=True).first()
+
+
+def _create_catalog_version():
+    # Строку создаёт первый обратившийся процесс; гонка двух вставок безопасна
+    CatalogVersion.objects.bulk_create([CatalogVersion(pk=CATALOG_VERSION_ID)], ignore_conflicts=True)
+
+
+def get_catalog_version():
+    version = _catalog_version()
+    if version is None:
+        _create_catalog_version()
+        version = _catalog_version()
+    return version
+
+
+def bump_catalog_version():
+    # Атомарный UPDATE: параллельные записи в разных воркерах не теряют инкременты
+    if not CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).update(version=F('version') + 1):
+        _create_catalog_version()
+        CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).update(version=F('version') + 1)
+
+
+def feed_cache_key(name, tags, time_filter):
+    params = json.dumps([sorted(tags), time_filter or ''], ensure_ascii=False)
+    digest = hashlib.md5(params.encode('utf-8')).hexdigest()
+    return f'mangalib:feed:{name}:{get_catalog_version()}:{digest}'
+
+
+def cached_feed(name, tags, time_filter, build):
+    key = feed_cache_key(name, tags, time_filter)
+    data = cache.get(key)
+    if data is not None:
+        _increment(FEED_HITS_KEY)
+        return data
+
+    _increment(FEED_MISSES_KEY)
+    data = build()
+    cache.set(key, data, settings.FEED_CACHE_TIMEOUT)
+    return data
+
+
+def feed_cache_stats():
+    hits = cache.get(FEED_HITS_KEY, 0)
+    misses = cache.get(FEED_MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'catalog_version': get_catalog_version(),
+    }
@@ -0,0 +1,16 @@
+from django.db.models import F
+
+from .models import Manga, User
+
+
+# Поле-счётчик на Manga для каждой связи пользователя с мангой
+MANGA_COUNTER_FIELDS = {
+    User.bookmarks.through: 'bookmark_count',
+    User.favourite.through: 'favourite_count',
+}
+
+
+def change_manga_counter(field, manga_ids, delta):
+    # Атомарный инкремент через F(), без чтения текущего значения в Python
+    if manga_ids and delta:
+        Manga.objects.filter(pk__in=manga_ids).update(**{field: F(field) + delta})
@@ -0,0 +1,111 @@
+import logging
+import os
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from django.conf import settings
+from django.http import Http404
+from django.utils.cache import patch_vary_headers
+
+from .media import is_content_addressed, resolve_media_path, serve_media
+from .models import ImageVariant
+
+logger = logging.getLogger(__name__)
+
+PIL_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+
+def variant_name(source_name, width, fmt):
+    # variants/<исходный путь без расширения>/<ширина>.<расширение>
+    base, _ = os.path.splitext(source_name)
+    return f'variants/{base}/{width}.{PIL_FORMATS[fmt][1]}'
+
+
+def save_variant(image, name, fmt):
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pil_format = PIL_FORMATS[fmt][0]
+    if pil_format == 'JPEG':
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(path, pil_format, quality=settings.IMAGE_VARIANT_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(path, pil_format, quality=settings.IMAGE_VARIANT_QUALITY, method=4)
+    return os.path.getsize(path)
+
+
+def delete_variants(source_name):
+    for variant in ImageVariant.objects.filter(source=source_name):
+        try:
+            os.remove(os.path.join(settings.MEDIA_ROOT, variant.image.name))
+        except FileNotFoundError:
+            pass
+    ImageVariant.objects.filter(source=source_name).delete()
+
+
+def generate_variants(source_name, widths):
+    # Пересоздаёт набор производных для файла; старые записи и файлы удаляются,
+    # так что перезапись обложки по тому же пути не оставляет устаревших копий
+    try:
+        source_path = resolve_media_path(source_name)
+    except Http404:
+        logger.warning('Image variants skipped: %s not found in MEDIA_ROOT', source_name)
+        return []
+
+    delete_variants(source_name)
+    try:
+        with Image.open(source_path) as original:
+            original.seek(0)  # для анимаций берём первый кадр
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+            variants = []
+            for width in sorted(widths):
+                # Не увеличиваем: если оригинал уже уже, ?w= отдаст его самого
+                if width >= image.width:
+                    break
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), Image.LANCZOS)
+                for fmt in settings.IMAGE_VARIANT_FORMATS:
+                    name = variant_name(source_name, width, fmt)
+                    file_size = save_variant(resized, name, fmt)
+                    variants.append(ImageVariant(
+                        source=source_name, image=name, format=fmt,
+                        width=width, height=height, file_size=file_size,
+                    ))
+    except (UnidentifiedImageError, OSError):
+        logger.exception('Image variants failed for %s', source_name)
+        return []
+
+    return ImageVariant.objects.bulk_create(variants)
+
+
+def negotiate_variant(request, source_name):
+    # ?w=<ширина> — отдаём наименьшую копию не уже запрошенной, формат по заголовку Accept
+    try:
+        requested_width = int(request.GET.get('w', ''))
+    except ValueError:
+        return source_name, False
+
+    fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    variant = (
+        ImageVariant.objects
+        .filter(source=source_name, format=fmt, width__gte=requested_width)
+        .order_by('width')
+        .values_list('image', flat=True)
+        .first()
+    )
+    # Если все копии уже запрошенной ширины, оригинал и есть лучший вариант
+    return variant or source_name, True
+
+
+def serve_image(request, source_name):
+    name, negotiated = negotiate_variant(request, source_name)
+    # URL страницы по хешу содержимого не меняется, его можно кешировать навсегда
+    response = serve_media(request, name, immutable=is_content_addressed(source_name))
+    if negotiated:
+        patch_vary_headers(response, ['Accept'])
+    return response
@@ -0,0 +1,356 @@
+import os
+import shutil
+import tempfile
+import zipfile
+
+from PIL import Image, UnidentifiedImageError
+from django.conf import settings
+from django.db import transaction
+from rest_framework import serializers
+
+from .blobs import acquire_blobs, blob_name, blob_path, release_blobs
+from .cache import bump_catalog_version
+from .images import generate_variants
+from .models import Manga, MangaPage
+from .pages import page_pool, process_page
+
+
+PAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+COVER_NAMES = ('cover.jpg', 'cover.jpeg', 'cover.png')
+
+
+def count_manga_chapters(manga):
+    # Количество уникальных глав (том, глава) для манги
+    return MangaPage.objects.filter(manga=manga).values('volume', 'chapter').distinct().count()
+
+
+class IngestLimits:
+    # Ограничения распаковки проверяются по фактически прочитанным байтам,
+    # а не по размерам из заголовков архива, которым нельзя доверять
+    def __init__(self):
+        self.max_entry_size = settings.CHAPTER_ZIP_MAX_ENTRY_SIZE
+        self.max_total_size = settings.CHAPTER_ZIP_MAX_TOTAL_SIZE
+        self.max_ratio = settings.CHAPTER_ZIP_MAX_RATIO
+        self.total_size = 0
+
+    def check_archive(self, infos):
+        if len(infos) > settings.CHAPTER_ZIP_MAX_ENTRIES:
+            raise serializers.ValidationError("Слишком много файлов в архиве.")
+        for info in infos:
+            if info.file_size > self.max_entry_size:
+                raise serializers.ValidationError(f"Файл {info.filename} слишком большой.")
+
+
+class LimitedReader:
+    # Обёртка над потоком из архива: считает байты и обрывает чтение при превышении лимитов
+    def __init__(self, fileobj, info, limits):
+        self.fileobj = fileobj
+        self.info = info
+        self.limits = limits
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.size += len(chunk)
+        self.limits.total_size += len(chunk)
+
+        if self.size > self.limits.max_entry_size:
+            raise serializers.ValidationError(f"Файл {self.info.filename} слишком большой.")
+        if self.limits.total_size > self.limits.max_total_size:
+            raise serializers.ValidationError("Архив слишком большой после распаковки.")
+        if self.size > max(self.info.compress_size, 1) * self.limits.max_ratio:
+            raise serializers.ValidationError(f"Подозрительная степень сжатия у {self.info.filename}.")
+        return chunk
+
+
+def stream_entry(zip_ref, info, dest_path, limits):
+    # Копируем кусками фиксированного размера во временный файл рядом с целевым
+    # и атомарно переименовываем: читатели никогда не видят недописанный файл
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), prefix='.', suffix='.part')
+    try:
+        with zip_ref.open(info) as source, os.fdopen(fd, 'wb') as destination:
+            reader = LimitedReader(source, info, limits)
+            shutil.copyfileobj(reader, destination, settings.CHAPTER_INGEST_BUFFER_SIZE)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return reader.size
+
+
+def read_image_size(file_path):
+    # Pillow читает только заголовок файла, декодирования пикселей не происходит
+    try:
+        with Image.open(file_path) as image:
+            return image.size
+    except (UnidentifiedImageError, OSError):
+        return None, None
+
+
+def is_archive_junk(info):
+    # Служебные файлы архиваторов: __MACOSX/ с AppleDouble-копиями (._001.jpg), .DS_Store и прочие
+    # скрытые файлы. Они не страницы и не должны проходить проверку как изображения
+    parts = info.filename.replace('\\', '/').split('/')
+    return any(part == '__MACOSX' or part.startswith('.') for part in parts if part)
+
+
+def split_archive(infos):
+    # Один проход по оглавлению архива: обложка и отсортированные страницы
+    cover = None
+    pages = []
+    for info in infos:
+        if info.is_dir():
+            continue
+        name = info.filename.lower()
+        if name.endswith(COVER_NAMES):
+            if cover is None:
+                cover = info
+        elif name.endswith(PAGE_EXTENSIONS) and 'cover' not in name:
+            pages.append(info)
+    pages.sort(key=lambda info: info.filename)
+    return cover, pages
+
+
+class ChapterIngest:
+    # Загрузка главы в три шага: файлы распаковываются в staging-папку, строки страниц
+    # пишутся пачками в одной транзакции, и только после коммита файлы переносятся
+    # на свои места. Упавшая загрузка не оставляет ни строк, ни файлов.
+    # Страницы хранятся по хешу содержимого (PageBlob): уже известные файлы не пишутся повторно.
+
+    def __init__(self, manga, volume, chapter, chapter_title, progress=None, lease=None):
+        self.manga = manga
+        self.volume = volume
+        self.chapter = chapter
+        self.chapter_title = chapter_title
+
+        self.manga_dir = os.path.join(settings.MEDIA_ROOT, 'manga', manga.Title)
+        self.cover_dir = os.path.join(self.manga_dir, 'cover')
+        self.limits = IngestLimits()
+
+        self.staging_dir = None
+        self.moves = []  # (путь в staging, итоговый путь)
+        self.staged_files = 0
+        self.pages = []
+        self.page_files = {}  # sha256 -> путь в staging
+        self.page_results = []
+        self.added = self.changed = self.removed = 0
+        self.cover_image = None
+
+        # Прогресс для фоновых задач: progress(ingest) вызывается после каждого файла.
+        # lease.hold() проверяет внутри транзакции записи, что задача всё ещё принадлежит воркеру
+        self.progress = progress
+        self.lease = lease
+        self.pages_total = 0
+        self.bytes_written = 0
+
+    def report(self):
+        if self.progress is not None:
+            self.progress(self)
+
+    def storage_name(self, *parts):
+        return '/'.join(['manga', self.manga.Title, *parts])
+
+    def stage(self, zip_ref, info):
+        self.staged_files += 1
+        staged_path = os.path.join(self.staging_dir, str(self.staged_files))
+        stream_entry(zip_ref, info, staged_path, self.limits)
+        # Распаковка большого архива идёт долго и до обработки страниц: heartbeat и здесь
+        self.report()
+        return staged_path
+
+    def submit(self, pool, info, staged_path):
+        return info, pool.submit(
+            process_page, staged_path, settings.CHAPTER_PAGE_REENCODE,
+            settings.CHAPTER_PAGE_QUALITY, settings.CHAPTER_PAGE_MAX_PIXELS,
+        )
+
+    def collect(self, submitted):
+        info, future = submitted
+        result = future.result()
+        if result.error:
+            raise serializers.ValidationError(f"{info.filename}: {result.error}")
+        self.bytes_written += result.file_size
+        return result
+
+    def stage_archive(self, zip_file):
+        # Основной процесс последовательно распаковывает файлы и отдаёт их пулу;
+        # декодирование и перекодирование идут параллельно, результаты собираются по порядку
+        pool = page_pool(settings.CHAPTER_PAGE_WORKERS)
+        try:
+            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+                infos = [info for info in zip_ref.infolist() if not is_archive_junk(info)]
+                self.limits.check_archive(infos)
+                cover, pages = split_archive(infos)
+                self.pages_total = len(pages)
+
+                submitted_cover = None
+                if cover is not None:
+                    staged_path = self.stage(zip_ref, cover)
+                    self.moves.append((staged_path, os.path.join(self.cover_dir, 'cover.jpg')))
+                    submitted_cover = self.submit(pool, cover, staged_path)
+
+                submitted_pages = []
+                for info in pages:
+                    staged_path = self.stage(zip_ref, info)
+                    submitted_pages.append((staged_path, self.submit(pool, info, staged_path)))
+
+            if submitted_cover is not None:
+                self.collect(submitted_cover)
+                self.cover_image = self.storage_name('cover', 'cover.jpg')
+
+            for index, (staged_path, submitted) in enumerate(submitted_pages, start=1):
+                result = self.collect(submitted)
+                # Повторяющиеся в архиве страницы достаточно положить один раз
+                self.page_files.setdefault(result.sha256, staged_path)
+                self.page_results.append(result)
+                self.pages.append(MangaPage(
+                    manga_id=self.manga.id,
+                    volume=self.volume,
+                    chapter=self.chapter,
+                    page_number=index,
+                    page_image=blob_name(result.sha256, result.format),
+                    Chapter_Title=self.chapter_title,  # Сохраняем название главы в поле модели
+                    width=result.width,
+                    height=result.height,
+                    file_size=result.file_size,
+                ))
+                self.report()
+        finally:
+            # При ошибке недоделанные задачи отменяются, а не обрабатываются впустую
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def diff_pages(self):
+        # Сравниваем архив с уже загруженной главой по уникальному ключу строки
+        # (название главы, номер страницы). Имя файла страницы выводится из хеша содержимого,
+        # так что совпадение имени означает те же байты.
+        existing = {
+            (page.Chapter_Title, page.page_number): page
+            for page in MangaPage.objects.filter(
+                manga_id=self.manga.id, volume=self.volume, chapter=self.chapter,
+            ).only('id', 'page_number', 'page_image', 'blob_id', 'Chapter_Title').order_by('id')
+        }
+        # Строки той же главы под другим названием: при перезаливке с новым названием
+        # они переиспользуются по номеру страницы, каждая не больше одного раза
+        other_titles = {}
+        for chapter_title, page_number in existing:
+            if chapter_title != self.chapter_title:
+                other_titles.setdefault(page_number, []).append((chapter_title, page_number))
+
+        added, changed, renamed, released = [], [], [], []
+        for page, result in zip(self.pages, self.page_results):
+            current = existing.pop((page.Chapter_Title, page.page_number), None)
+            if current is None and other_titles.get(page.page_number):
+                current = existing.pop(other_titles[page.page_number].pop(0))
+            if current is None:
+                added.append((page, result))
+            elif current.blob_id is None or current.page_image.name != page.page_image.name:
+                page.pk = current.pk
+                changed.append((page, result))
+                released.append(current.blob_id)
+            elif current.Chapter_Title != page.Chapter_Title:
+                current.Chapter_Title = page.Chapter_Title
+                renamed.append(current)
+        return added, changed, renamed, list(existing.values()), released
+
+    def save_rows(self):
+        with transaction.atomic():
+            if self.lease is not None:
+                self.lease.hold()
+            # Блокируем строку манги, чтобы параллельные загрузки не затёрли счётчик глав
+            manga = Manga.objects.select_for_update().get(id=self.manga.id)
+
+            if self.cover_image is not None:
+                manga.Image = self.cover_image
+                manga.save(update_fields=['Image'])
+
+            # Повторная загрузка главы: пишем только новые и изменившиеся страницы, удаляем пропавшие
+            added, changed, renamed, removed, released = self.diff_pages()
+            written = added + changed
+            self.pages = [page for page, result in written]
+
+            # Ссылки на файлы страниц: новые блобы создаются, refcount растёт атомарно
+            if written:
+                blobs = acquire_blobs([result for page, result in written])
+                for page, result in written:
+                    page.blob = blobs[result.sha256]
+                    page.page_image = page.blob.image.name
+
+            if removed:
+                # Сначала удаляем пропавшие страницы, чтобы их ключи не мешали новым и переименованным.
+                # Обычный delete(): post_delete уменьшит refcount у файлов удалённых страниц
+                MangaPage.objects.filter(pk__in=[page.pk for page in removed]).delete()
+
+            batch_size = settings.CHAPTER_INGEST_BATCH_SIZE
+            # Пачки INSERT вместо отдельного запроса на каждую страницу
+            MangaPage.objects.bulk_create([page for page, result in added], batch_size=batch_size)
+            if changed:
+                MangaPage.objects.bulk_update(
+                    [page for page, result in changed],
+                    ['blob', 'page_image', 'Chapter_Title', 'width', 'height', 'file_size'],
+                    batch_size=batch_size,
+                )
+                # bulk_update не шлёт сигналов: старые файлы отпускаем сами
+                release_blobs(released)
+            if renamed:
+                MangaPage.objects.bulk_update(renamed, ['Chapter_Title'], batch_size=batch_size)
+
+            self.added, self.changed, self.removed = len(added), len(changed), len(removed)
+            if added or removed:
+                # Обновляем денормализованный счётчик глав в той же транзакции
+                manga.Chapters = count_manga_chapters(manga)
+                manga.save(update_fields=['Chapters'])
+            if written or renamed or removed or self.cover_image is not None:
+                manga.bump_version()
+            if added or removed or self.cover_image is not None:
+                # Число глав и обложка есть в карточках лент: закешированные ленты устарели.
+                # Версия каталога в той же транзакции, поэтому станет видна вместе со страницами
+                bump_catalog_version()
+
+            # Файлы становятся видны только после успешного коммита
+            transaction.on_commit(self.publish)
+        self.manga = manga
+
+    def publish(self):
+        for staged_path, final_path in self.moves:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(staged_path, final_path)
+
+        # Файл блоба пишется, только если его ещё нет: содержимое по этому пути всегда одно и то же
+        new_blobs = []
+        for page in self.pages:
+            name = page.page_image.name
+            final_path = blob_path(name)
+            staged_path = self.page_files.get(page.blob.sha256)
+            if staged_path is None or os.path.exists(final_path):
+                continue
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(staged_path, final_path)
+            del self.page_files[page.blob.sha256]
+            new_blobs.append(name)
+        self.discard_staging()
+
+        if self.cover_image is not None:
+            generate_variants(self.cover_image, settings.COVER_VARIANT_WIDTHS)
+        for name in new_blobs:
+            generate_variants(name, settings.PAGE_VARIANT_WIDTHS)
+
+    def discard_staging(self):
+        if self.staging_dir is not None:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def run(self, zip_file):
+        # staging-папка на той же файловой системе, что и итоговые, чтобы перенос был атомарным
+        os.makedirs(self.manga_dir, exist_ok=True)
+        self.staging_dir = tempfile.mkdtemp(dir=self.manga_dir, prefix='.staging-')
+        try:
+            self.stage_archive(zip_file)
+            self.save_rows()
+        except BaseException:
+            self.discard_staging()
+            raise
+        return self.manga
+
+
+def ingest_chapter_archive(manga, zip_file, volume, chapter, chapter_title, progress=None, lease=None):
+    return ChapterIngest(manga, volume, chapter, chapter_title, progress, lease).run(zip_file)
@@ -0,0 +1,135 @@
+import time
+import uuid
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .ingest import ingest_chapter_archive
+from .models import IngestJob
+
+
+def claim_next_job():
+    # SKIP LOCKED: несколько воркеров не ждут друг друга и не берут одну задачу дважды.
+    # Задачу упавшего воркера (давно без heartbeat) забираем заново.
+    stale_before = timezone.now() - timedelta(seconds=settings.INGEST_JOB_STALE_AFTER)
+    with transaction.atomic():
+        job = (
+            IngestJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=IngestJob.STATUS_QUEUED)
+                | Q(status=IngestJob.STATUS_RUNNING, heartbeat_at__lt=stale_before)
+            )
+            .order_by('id')
+            .first()
+        )
+        if job is None:
+            return None
+        now = timezone.now()
+        job.status = IngestJob.STATUS_RUNNING
+        job.started_at = now
+        job.heartbeat_at = now
+        job.pages_processed = 0
+        job.bytes_written = 0
+        job.error = ''
+        job.lease = uuid.uuid4().hex
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at', 'pages_processed', 'bytes_written', 'error',
+                                'lease'])
+    return job
+
+
+class JobLeaseLost(Exception):
+    pass
+
+
+class JobLease:
+    # Задача принадлежит воркеру, пока в строке его токен. Если воркер завис и задачу
+    # забрал другой, первый узнаёт об этом при следующем heartbeat или перед записью
+    # страниц и останавливается, ничего не сохранив
+    def __init__(self, job):
+        self.job = job
+
+    def rows(self):
+        return IngestJob.objects.filter(pk=self.job.pk, lease=self.job.lease)
+
+    def heartbeat(self, **fields):
+        if not self.rows().update(heartbeat_at=timezone.now(), **fields):
+            raise JobLeaseLost
+
+    def held(self):
+        # Вызывается внутри транзакции: блокировка строки до коммита не даёт другому воркеру
+        # забрать задачу (claim_next_job пропускает заблокированные строки)
+        return bool(list(self.rows().select_for_update().values_list('pk', flat=True)))
+
+    def hold(self):
+        if not self.held():
+            raise JobLeaseLost
+
+
+def error_message(exc):
+    if isinstance(exc, serializers.ValidationError):
+        detail = exc.detail
+        if isinstance(detail, list):
+            return ' '.join(str(message) for message in detail)
+        return str(detail)
+    if isinstance(exc, zipfile.BadZipFile):
+        return "Файл не является ZIP-архивом."
+    return f'{exc.__class__.__name__}: {exc}'
+
+
+class JobProgress:
+    # Пишем прогресс не на каждой странице, а раз в INGEST_PROGRESS_INTERVAL страниц;
+    # heartbeat — не реже раза в INGEST_HEARTBEAT_INTERVAL секунд, в том числе пока идёт распаковка
+    def __init__(self, lease):
+        self.lease = lease
+        self.reported_pages = 0
+        self.reported_at = time.monotonic()
+
+    def __call__(self, ingest):
+        pages_processed = len(ingest.pages)
+        if (pages_processed - self.reported_pages < settings.INGEST_PROGRESS_INTERVAL
+                and pages_processed != ingest.pages_total
+                and time.monotonic() - self.reported_at < settings.INGEST_HEARTBEAT_INTERVAL):
+            return
+        self.reported_pages = pages_processed
+        self.reported_at = time.monotonic()
+        self.lease.heartbeat(
+            pages_total=ingest.pages_total,
+            pages_processed=pages_processed,
+            bytes_written=ingest.bytes_written,
+        )
+
+
+def run_job(job):
+    lease = JobLease(job)
+    fields = {}
+    try:
+        with job.archive.open('rb') as archive:
+            ingest_chapter_archive(
+                job.manga, archive, job.volume, job.chapter, job.chapter_title,
+                progress=JobProgress(lease), lease=lease,
+            )
+    except JobLeaseLost:
+        pass
+    except Exception as exc:
+        fields['status'] = IngestJob.STATUS_FAILED
+        fields['error'] = error_message(exc)
+    else:
+        fields['status'] = IngestJob.STATUS_DONE
+
+    with transaction.atomic():
+        # Задачу забрал другой воркер: архив и статус теперь его
+        if fields and lease.held():
+            # Архив больше не нужен: страницы уже на месте, а упавшую задачу пользователь загрузит заново
+            archive_name = job.archive.name
+            transaction.on_commit(lambda: job.archive.storage.delete(archive_name))
+            fields['archive'] = ''
+            fields['finished_at'] = timezone.now()
+            IngestJob.objects.filter(pk=job.pk).update(**fields)
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,40 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from MangaLib.models import MangaPage
+from MangaLib.ingest import read_image_size
+
+
+class Command(BaseCommand):
+    help = 'Fill width, height and file_size for pages uploaded before they were recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pages = MangaPage.objects.filter(file_size__isnull=True).only('id', 'page_image').order_by('id')
+
+        batch = []
+        updated = 0
+        for page in pages.iterator(chunk_size=batch_size):
+            try:
+                path = page.page_image.path
+                page.file_size = os.path.getsize(path)
+            except (ValueError, OSError):
+                self.stdout.write(self.style.WARNING(f'Page {page.id}: file not found'))
+                continue
+            page.width, page.height = read_image_size(path)
+            batch.append(page)
+
+            if len(batch) >= batch_size:
+                MangaPage.objects.bulk_update(batch, ['width', 'height', 'file_size'])
+                updated += len(batch)
+                batch = []
+
+        if batch:
+            MangaPage.objects.bulk_update(batch, ['width', 'height', 'file_size'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Metadata filled for {updated} pages'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from MangaLib.models import Manga, MangaPage
+from MangaLib.views import CATALOG_SORT_ORDERING
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the public listing queries and fail if any of them falls back to a sequential scan'
+
+    def listing_queries(self):
+        approved = Manga.objects.filter(Moderation_status='approved')
+        for sort_by, ordering in CATALOG_SORT_ORDERING.items():
+            prefix = '-' if ordering.startswith('-') else ''
+            yield f'catalog:{sort_by}', approved.order_by(ordering, f'{prefix}id')[:21]
+        yield 'popular', approved.order_by('-Score', '-id')[:6]
+        yield 'new_releases', approved.order_by('-Created_at')[:6]
+        yield 'moderation_queue', Manga.objects.filter(Moderation_status='pending').order_by('Created_at')[:20]
+        yield 'manga_page', MangaPage.objects.filter(manga_id=1, volume=1, Chapter_Title='Chapter title', page_number=1)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Plan checks are only supported on PostgreSQL')
+
+        failed = []
+        with transaction.atomic():
+            # На маленьком наборе данных планировщик и так выберет Seq Scan;
+            # с enable_seqscan=off он сделает это только если подходящего индекса нет
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for name, queryset in self.listing_queries():
+                plan = queryset.explain()
+                if 'Seq Scan' in plan:
+                    failed.append(name)
+                    self.stdout.write(self.style.ERROR(f'{name}: sequential scan\n{plan}'))
+                else:
+                    self.stdout.write(f'{name}: ok')
+
+        if failed:
+            raise CommandError(f'Sequential scans in: {", ".join(failed)}')
+        self.stdout.write(self.style.SUCCESS('All listing queries use indexes'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from MangaLib.blobs import collect_unreferenced_blobs
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed page files that no manga page references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Blobs deleted per transaction')
+
+    def handle(self, *args, **options):
+        deleted = 0
+        while True:
+            count = collect_unreferenced_blobs(options['batch_size'])
+            deleted += count
+            if count < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced page files'))
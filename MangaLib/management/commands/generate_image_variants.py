@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from MangaLib.images import generate_variants
+from MangaLib.models import ImageVariant, Manga, MangaPage, Person
+
+
+class Command(BaseCommand):
+    help = 'Generate WebP/JPEG derivatives for existing covers, person photos and manga pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist')
+
+    def handle(self, *args, **options):
+        sources = [
+            (Manga.objects.values_list('Image', flat=True), settings.COVER_VARIANT_WIDTHS),
+            (Person.objects.values_list('profile_image', flat=True), settings.COVER_VARIANT_WIDTHS),
+            (MangaPage.objects.values_list('page_image', flat=True), settings.PAGE_VARIANT_WIDTHS),
+        ]
+        done = set()
+        if not options['force']:
+            done.update(ImageVariant.objects.values_list('source', flat=True).distinct())
+
+        generated = 0
+        for names, widths in sources:
+            for name in names.distinct().iterator():
+                if not name or name in done:
+                    continue
+                done.add(name)
+                generated += len(generate_variants(name, widths))
+
+        self.stdout.write(self.style.SUCCESS(f'Generated {generated} image variants'))
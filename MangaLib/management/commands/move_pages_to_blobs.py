@@ -0,0 +1,52 @@
+import os
+
+from PIL import Image, UnidentifiedImageError
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from MangaLib.blobs import BLOB_EXTENSIONS, acquire_blobs, blob_path
+from MangaLib.images import delete_variants, generate_variants
+from MangaLib.models import MangaPage
+from MangaLib.pages import PageResult, file_sha256
+
+
+class Command(BaseCommand):
+    help = 'Move pages stored under media/manga/<title>/volume_N/ to content-addressed storage'
+
+    def handle(self, *args, **options):
+        moved = shared = skipped = 0
+        pages = MangaPage.objects.filter(blob__isnull=True).only('id', 'page_image').order_by('id')
+        for page in pages.iterator():
+            old_name = page.page_image.name
+            old_path = os.path.join(settings.MEDIA_ROOT, old_name)
+            try:
+                with Image.open(old_path) as image:
+                    fmt, (width, height) = image.format, image.size
+            except (FileNotFoundError, UnidentifiedImageError, OSError):
+                skipped += 1
+                continue
+            if fmt not in BLOB_EXTENSIONS:
+                skipped += 1
+                continue
+
+            result = PageResult(width, height, os.path.getsize(old_path), file_sha256(old_path), fmt, None)
+            with transaction.atomic():
+                blob = acquire_blobs([result])[result.sha256]
+                MangaPage.objects.filter(pk=page.pk).update(blob=blob, page_image=blob.image.name)
+
+            # Строка уже указывает на блоб; старый файл либо становится им, либо это дубликат
+            new_path = blob_path(blob.image.name)
+            delete_variants(old_name)
+            if os.path.exists(new_path):
+                os.remove(old_path)
+                shared += 1
+            else:
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.replace(old_path, new_path)
+                generate_variants(blob.image.name, settings.PAGE_VARIANT_WIDTHS)
+                moved += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} page files, {shared} were duplicates, skipped {skipped}'
+        ))
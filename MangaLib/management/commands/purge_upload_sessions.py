@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from MangaLib.uploads import purge_abandoned_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete open chunked upload sessions that received no chunks for CHUNKED_UPLOAD_SESSION_TTL seconds'
+
+    def handle(self, *args, **options):
+        purged = purge_abandoned_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {purged} abandoned upload sessions'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db.models import CharField, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat
+
+from MangaLib.models import Manga, MangaPage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Manga.Chapters from MangaPage rows in a single UPDATE'
+
+    def handle(self, *args, **options):
+        # Уникальная глава — пара (том, глава)
+        chapters = (
+            MangaPage.objects
+            .filter(manga=OuterRef('pk'))
+            .order_by()
+            .values('manga')
+            .annotate(count=Count(
+                Concat('volume', Value(':'), 'chapter', output_field=CharField()),
+                distinct=True,
+            ))
+            .values('count')
+        )
+        updated = Manga.objects.update(Chapters=Coalesce(Subquery(chapters), 0))
+        self.stdout.write(self.style.SUCCESS(f'Chapter counts rebuilt for {updated} manga'))
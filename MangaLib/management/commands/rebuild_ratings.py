@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from MangaLib.models import Manga, Review
+from MangaLib.ratings import bayesian_score, rating_average, rebuild_histograms
+
+
+class Command(BaseCommand):
+    help = 'Recompute rating sum, count, average, Bayesian score and histogram for every manga from reviews'
+
+    def handle(self, *args, **options):
+        reviews = Review.objects.filter(manga=OuterRef('pk')).order_by().values('manga')
+        rating_sum = Coalesce(
+            Subquery(reviews.annotate(total=Sum('rating')).values('total')),
+            Value(0.0), output_field=FloatField(),
+        )
+        rating_count = Coalesce(Subquery(reviews.annotate(count=Count('id')).values('count')), 0)
+        updated = Manga.objects.update(
+            RatingSum=rating_sum,
+            RatingCount=rating_count,
+            Rating=rating_average(rating_sum, rating_count),
+            Score=bayesian_score(rating_sum, rating_count),
+        )
+        buckets = rebuild_histograms()
+        self.stdout.write(self.style.SUCCESS(f'Ratings rebuilt for {updated} manga, {buckets} histogram buckets'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from MangaLib.models import Manga, User
+
+
+class Command(BaseCommand):
+    help = 'Reconcile Manga.bookmark_count and favourite_count with the bookmark/favourite tables'
+
+    def handle(self, *args, **options):
+        actual = {}
+        for through, field in ((User.bookmarks.through, 'bookmark_count'),
+                               (User.favourite.through, 'favourite_count')):
+            counts = (
+                through.objects
+                .filter(manga_id=OuterRef('pk'))
+                .order_by()
+                .values('manga_id')
+                .annotate(count=Count('id'))
+                .values('count')
+            )
+            actual[field] = Coalesce(Subquery(counts), 0)
+
+        drifted = (
+            Manga.objects
+            .annotate(actual_bookmarks=actual['bookmark_count'], actual_favourites=actual['favourite_count'])
+            .filter(~Q(bookmark_count=F('actual_bookmarks')) | ~Q(favourite_count=F('actual_favourites')))
+            .values_list('pk', flat=True)
+        )
+        drifted_ids = list(drifted)
+        if drifted_ids:
+            Manga.objects.filter(pk__in=drifted_ids).update(**actual)
+
+        self.stdout.write(self.style.SUCCESS(f'Popularity counters repaired for {len(drifted_ids)} manga'))
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from MangaLib.jobs import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Process queued chapter uploads; several workers can run side by side'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--sleep', type=float, default=settings.INGEST_WORKER_POLL_INTERVAL,
+                            help='Seconds to wait between polls of an empty queue')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                close_old_connections()
+                job = claim_next_job()
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+
+                self.stdout.write(f'Job {job.pk}: manga {job.manga_id}, volume {job.volume}, chapter {job.chapter}')
+                run_job(job)
+                if job.status == job.STATUS_DONE:
+                    self.stdout.write(self.style.SUCCESS(f'Job {job.pk}: {job.pages_processed} pages'))
+                else:
+                    self.stdout.write(self.style.ERROR(f'Job {job.pk} failed: {job.error}'))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,188 @@
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Имя файла блоба — SHA-256 его содержимого: pages/ab/cd/<sha256>.<расширение>
+BLOB_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$')
+STREAM_CHUNK_SIZE = 64 * 1024
+# Каталог страниц, адресуемых по содержимому: файл по такому пути никогда не меняется
+PAGE_BLOB_DIR = 'pages'
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def media_root():
+    return os.path.realpath(settings.MEDIA_ROOT)
+
+
+def resolve_media_path(name):
+    # Путь внутри MEDIA_ROOT; всё, что выходит за его пределы или не существует, — 404
+    root = media_root()
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise Http404("File not found.")
+    return path
+
+
+def file_etag(path, stat):
+    # SHA-256 содержимого считаем один раз и кешируем по (путь, mtime, размер):
+    # перезапись файла меняет ключ, и хеш пересчитывается. Отдельный кеш с ограниченным
+    # временем жизни, чтобы хеши файлов не вытесняли закешированные ленты каталога
+    cache = caches['media']
+    path_key = hashlib.md5(path.encode('utf-8')).hexdigest()
+    key = f'mangalib:file_etag:{path_key}:{stat.st_mtime_ns}:{stat.st_size}'
+    digest = cache.get(key)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        cache.set(key, digest, settings.MEDIA_ETAG_CACHE_TIMEOUT)
+    return f'"{digest}"'
+
+
+def content_etag(path):
+    # Для страниц, адресуемых по содержимому, хеш уже записан в имени файла: читать файл не нужно
+    relative = os.path.relpath(path, media_root()).replace(os.sep, '/')
+    if not is_content_addressed(relative):
+        return None
+    match = BLOB_NAME_RE.match(relative[len(PAGE_BLOB_DIR) + 1:])
+    return f'"{match.group(1)}"' if match else None
+
+
+def is_versioned_request(request, etag):
+    # URL вида ...?v=<префикс хеша> указывает на конкретное содержимое и никогда не меняется
+    version = request.GET.get('v', '')
+    return len(version) >= 8 and etag.strip('"').startswith(version)
+
+
+def is_content_addressed(name):
+    return name.startswith(PAGE_BLOB_DIR + '/')
+
+
+def set_media_validators(response, request, etag, stat, immutable=False):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if immutable or is_versioned_request(request, etag):
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        # Неверсионированный URL может получить новое содержимое (перезаливка главы)
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+def parse_range(header, size):
+    # Поддерживаем один диапазон; мультидиапазоны игнорируем и отдаём файл целиком (RFC 9110)
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        suffix = int(end)
+        if suffix == 0:
+            raise UnsatisfiableRange
+        return max(size - suffix, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        # Некорректный диапазон (last-pos < first-pos) игнорируется, как и неразобранный (RFC 9110, 14.1.1)
+        return None
+    if start >= size:
+        raise UnsatisfiableRange
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def range_applies(request, etag, stat):
+    if_range = request.headers.get('If-Range')
+    if if_range is None:
+        return True
+    return if_range == etag or if_range == http_date(stat.st_mtime)
+
+
+def iter_file_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def inline_response(request, path, content_type, etag, stat):
+    range_header = request.headers.get('Range')
+    if range_header and range_applies(request, etag, stat):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except UnsatisfiableRange:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(iter_file_range(path, start, length), status=206,
+                                             content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            response['Content-Length'] = str(length)
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    # Потоковая отдача кусками, файл целиком в память не читается
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve_media(request, name, content_type=None, immutable=False):
+    # Приложение проверяет доступ, находит файл и отвечает на условные запросы;
+    # байты, если настроено, отдаёт фронтовой сервер (FILE_DELIVERY_BACKEND),
+    # и он же тогда обрабатывает Range
+    path = resolve_media_path(name)
+    stat = os.stat(path)
+    etag = content_etag(path) or file_etag(path, stat)
+    if content_type is None:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        return set_media_validators(not_modified, request, etag, stat, immutable)
+
+    backend = settings.FILE_DELIVERY_BACKEND
+    if backend == 'inline':
+        response = inline_response(request, path, content_type, etag, stat)
+
+    elif backend == 'nginx':
+        # nginx сам раскодирует URI и отдаст файл из internal-location
+        relative = os.path.relpath(path, media_root()).replace(os.sep, '/')
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.FILE_DELIVERY_NGINX_PREFIX.rstrip('/') + '/' + quote(relative)
+
+    elif backend == 'apache':
+        # mod_xsendfile ждёт путь в файловой системе как есть, без URL-кодирования:
+        # передаём байты UTF-8 через latin-1, чтобы они дошли до Apache без изменений
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path.encode('utf-8').decode('latin-1')
+
+    else:
+        raise ImproperlyConfigured(f'Unknown FILE_DELIVERY_BACKEND: {backend!r}')
+
+    if response.status_code == 416:
+        return response
+    return set_media_validators(response, request, etag, stat, immutable)
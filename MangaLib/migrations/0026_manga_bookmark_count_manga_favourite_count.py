@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:04
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    Manga = apps.get_model('MangaLib', 'Manga')
+    User = apps.get_model('MangaLib', 'User')
+    for through, field in ((User.bookmarks.through, 'bookmark_count'), (User.favourite.through, 'favourite_count')):
+        counts = (
+            through.objects
+            .filter(manga_id=models.OuterRef('pk'))
+            .order_by()
+            .values('manga_id')
+            .annotate(count=models.Count('id'))
+            .values('count')
+        )
+        Manga.objects.update(**{field: models.functions.Coalesce(models.Subquery(counts), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0025_person_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manga',
+            name='bookmark_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='manga',
+            name='favourite_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['-bookmark_count', '-id'], name='manga_approved_popularity_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0026_manga_bookmark_count_manga_favourite_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['-RatingCount', '-Rating'], name='manga_approved_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['-Rating', '-id'], name='manga_approved_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['-Chapters', '-id'], name='manga_approved_chapters_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['-Release', '-id'], name='manga_approved_release_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['-Created_at', '-id'], name='manga_approved_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['Title', 'id'], name='manga_approved_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['-id'], name='manga_approved_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'pending')), fields=['Created_at'], name='manga_pending_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mangapage',
+            index=models.Index(fields=['manga', 'volume', 'Chapter_Title', 'page_number'], name='mangapage_lookup_idx'),
+        ),
+    ]
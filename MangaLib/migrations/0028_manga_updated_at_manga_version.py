@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0027_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manga',
+            name='Updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='manga',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
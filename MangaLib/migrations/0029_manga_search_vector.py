@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:08
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def fill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Manga = apps.get_model('MangaLib', 'Manga')
+    Manga.objects.update(search_vector=(
+        SearchVector('Title', weight='A', config='russian') +
+        SearchVector('Author', 'Artist', 'Publisher', weight='B', config='russian') +
+        SearchVector('Description', weight='C', config='russian')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0028_manga_updated_at_manga_version'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='manga',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='manga',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='manga_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['Title'], name='manga_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['Author'], name='manga_author_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['Artist'], name='manga_artist_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['Publisher'], name='manga_publisher_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0030_mangapage_width_height_file_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('image', models.ImageField(max_length=255, upload_to='')),
+                ('format', models.CharField(choices=[('webp', 'image/webp'), ('jpeg', 'image/jpeg')], max_length=8)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('file_size', models.PositiveIntegerField()),
+            ],
+            options={
+                'unique_together': {('source', 'format', 'width')},
+            },
+        ),
+    ]
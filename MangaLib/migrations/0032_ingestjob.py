@@ -0,0 +1,40 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:16
+
+import MangaLib.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0031_imagevariant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive', models.FileField(blank=True, storage=MangaLib.models.ingest_upload_storage, upload_to='%Y/%m/%d/')),
+                ('volume', models.IntegerField()),
+                ('chapter', models.IntegerField()),
+                ('chapter_title', models.CharField(max_length=128)),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Обрабатывается'), ('done', 'Готово'), ('failed', 'Ошибка')], default='queued', max_length=10)),
+                ('pages_total', models.PositiveIntegerField(default=0)),
+                ('pages_processed', models.PositiveIntegerField(default=0)),
+                ('bytes_written', models.PositiveBigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_jobs', to=settings.AUTH_USER_MODEL)),
+                ('manga', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_jobs', to='MangaLib.manga')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['id'], name='ingestjob_queued_idx')],
+            },
+        ),
+    ]
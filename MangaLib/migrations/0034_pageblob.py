@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:21
+
+import MangaLib.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0033_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='mangapage',
+            unique_together={('manga', 'volume', 'chapter', 'Chapter_Title', 'page_number')},
+        ),
+        migrations.AlterField(
+            model_name='mangapage',
+            name='page_image',
+            field=models.ImageField(max_length=255, upload_to=MangaLib.models.manga_pages_directory_path),
+        ),
+        migrations.CreateModel(
+            name='PageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('image', models.ImageField(max_length=255, upload_to='')),
+                ('file_size', models.PositiveIntegerField()),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('refcount', 0)), fields=['id'], name='pageblob_unreferenced_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='mangapage',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='pages', to='MangaLib.pageblob'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:24
+
+from django.db import migrations, models
+
+
+def fill_rating_totals(apps, schema_editor):
+    # Старые RatingCount/Rating обновлялись неатомарно и могли разойтись с отзывами:
+    # сумму, количество и среднюю пересчитываем из Review одним UPDATE. Score в 0036 считается уже от них
+    Manga = apps.get_model('MangaLib', 'Manga')
+    Review = apps.get_model('MangaLib', 'Review')
+    reviews = Review.objects.filter(manga_id=models.OuterRef('pk')).order_by().values('manga_id')
+    total = models.functions.Coalesce(
+        models.Subquery(reviews.annotate(total=models.Sum('rating')).values('total')), 0.0,
+    )
+    count = models.functions.Coalesce(
+        models.Subquery(reviews.annotate(count=models.Count('id')).values('count')), 0,
+    )
+    Manga.objects.update(
+        RatingSum=total,
+        RatingCount=count,
+        Rating=models.functions.Round(
+            models.functions.Cast(total, models.FloatField()) / models.functions.Greatest(count, 1),
+            2,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0034_pageblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manga',
+            name='RatingSum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_rating_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:25
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Cast, Floor, Greatest, Least, Round
+
+
+def fill_histogram_and_score(apps, schema_editor):
+    Manga = apps.get_model('MangaLib', 'Manga')
+    Review = apps.get_model('MangaLib', 'Review')
+    RatingBucket = apps.get_model('MangaLib', 'RatingBucket')
+
+    buckets = (
+        Review.objects
+        .annotate(bucket=Least(Greatest(Cast(Floor(models.F('rating') + 0.5), models.IntegerField()), 0), 10))
+        .order_by()
+        .values('manga_id', 'bucket')
+        .annotate(count=models.Count('id'))
+    )
+    RatingBucket.objects.bulk_create(
+        [RatingBucket(manga_id=row['manga_id'], bucket=row['bucket'], count=row['count']) for row in buckets],
+        batch_size=1000,
+    )
+
+    weight = float(settings.RATING_PRIOR_WEIGHT)
+    Manga.objects.update(Score=Round(
+        (weight * settings.RATING_PRIOR_MEAN + models.F('RatingSum')) / (weight + models.F('RatingCount'))
+        * Least(models.F('RatingCount'), 1),
+        4,
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0035_manga_ratingsum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveSmallIntegerField(validators=[django.core.validators.MaxValueValidator(10)])),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='manga',
+            name='manga_approved_top_idx',
+        ),
+        migrations.AddField(
+            model_name='manga',
+            name='Score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='manga',
+            index=models.Index(condition=models.Q(('Moderation_status', 'approved')), fields=['-Score', '-id'], name='manga_approved_score_idx'),
+        ),
+        migrations.AddField(
+            model_name='ratingbucket',
+            name='manga',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_buckets', to='MangaLib.manga'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ratingbucket',
+            unique_together={('manga', 'bucket')},
+        ),
+        migrations.RunPython(fill_histogram_and_score, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0036_rating_histogram_score'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['manga', 'created_at', 'id'], name='review_manga_created_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-17 21:05
+
+from django.db import migrations, models
+
+
+def rebuild_chapter_counts(apps, schema_editor):
+    # До user-002 Manga.Chapters никто не писал: пересчитываем одним UPDATE,
+    # как manage.py rebuild_chapter_counts
+    Manga = apps.get_model('MangaLib', 'Manga')
+    MangaPage = apps.get_model('MangaLib', 'MangaPage')
+    chapters = (
+        MangaPage.objects
+        .filter(manga=models.OuterRef('pk'))
+        .order_by()
+        .values('manga')
+        .annotate(count=models.Count(
+            models.functions.Concat('volume', models.Value(':'), 'chapter', output_field=models.CharField()),
+            distinct=True,
+        ))
+        .values('count')
+    )
+    Manga.objects.update(Chapters=models.functions.Coalesce(models.Subquery(chapters), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0037_review_manga_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_chapter_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MangaLib', '0039_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestjob',
+            name='lease',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -1,9 +1,15 @@
 import os
 
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.files.storage import FileSystemStorage
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
 from django.utils.text import slugify
 
 
@@ -62,8 +68,80 @@ class Manga(models.Model):
     Image = models.ImageField(upload_to='Manga/', default='Manga/image_10.jpg')
     Rating = models.FloatField(default=0, validators=[MinValueValidator(0), MaxValueValidator(10)])
     RatingCount = models.IntegerField(default=0)
+    # Сумма оценок; Rating = RatingSum / RatingCount пересчитывается тем же UPDATE (MangaLib/ratings.py)
+    RatingSum = models.FloatField(default=0)
+    # Байесовская оценка для рейтинговых списков: средняя, притянутая к RATING_PRIOR_MEAN
+    # с весом RATING_PRIOR_WEIGHT отзывов; хранится и обновляется вместе с суммой
+    Score = models.FloatField(default=0)
     Category = models.ManyToManyField(Category, related_name='manga')
     Created_at = models.DateTimeField(auto_now_add=True)
+    Updated_at = models.DateTimeField(auto_now=True)
+    # Версия для ETag: растёт при изменении тайтла, модерации, отзывах и загрузке глав
+    version = models.PositiveIntegerField(default=1)
+    # Полнотекстовый вектор (Title/Author/Artist/Publisher/Description), обновляется в MangaLib/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Денормализованные счётчики, поддерживаются сигналами m2m_changed (MangaLib/signals.py)
+    bookmark_count = models.IntegerField(default=0)
+    favourite_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Частичные индексы под сортировки публичных списков (только одобренные тайтлы).
+            # B-tree читается в обе стороны, поэтому один индекс обслуживает и title_az, и title_za.
+            models.Index(
+                fields=['-bookmark_count', '-id'],
+                name='manga_approved_popularity_idx',
+                condition=Q(Moderation_status='approved'),
+            ),
+            models.Index(
+                fields=['-Score', '-id'],
+                name='manga_approved_score_idx',
+                condition=Q(Moderation_status='approved'),
+            ),
+            models.Index(
+                fields=['-Rating', '-id'],
+                name='manga_approved_rating_idx',
+                condition=Q(Moderation_status='approved'),
+            ),
+            models.Index(
+                fields=['-Chapters', '-id'],
+                name='manga_approved_chapters_idx',
+                condition=Q(Moderation_status='approved'),
+            ),
+            models.Index(
+                fields=['-Release', '-id'],
+                name='manga_approved_release_idx',
+                condition=Q(Moderation_status='approved'),
+            ),
+            models.Index(
+                fields=['-Created_at', '-id'],
+                name='manga_approved_created_idx',
+                condition=Q(Moderation_status='approved'),
+            ),
+            models.Index(
+                fields=['Title', 'id'],
+                name='manga_approved_title_idx',
+                condition=Q(Moderation_status='approved'),
+            ),
+            models.Index(
+                fields=['-id'],
+                name='manga_approved_id_idx',
+                condition=Q(Moderation_status='approved'),
+            ),
+            # Очередь модерации
+            models.Index(
+                fields=['Created_at'],
+                name='manga_pending_created_idx',
+                condition=Q(Moderation_status='pending'),
+            ),
+            # Полнотекстовый поиск и триграммы (опечатки, ILIKE '%q%')
+            GinIndex(fields=['search_vector'], name='manga_search_vector_idx'),
+            GinIndex(fields=['Title'], name='manga_title_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['Author'], name='manga_author_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['Artist'], name='manga_artist_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['Publisher'], name='manga_publisher_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
 
     def __str__(self):
         return self.Title
@@ -76,17 +154,69 @@ class Manga(models.Model):
         manga_dir = os.path.join('media/Manga', slugify(self.Title))
         os.makedirs(manga_dir, exist_ok=True)
 
+    def bump_version(self):
+        # Атомарно, без перезаписи остальных полей строки
+        Manga.objects.filter(pk=self.pk).update(version=F('version') + 1, Updated_at=timezone.now())
+
+    @property
+    def etag(self):
+        return f'"manga-{self.pk}-v{self.version}"'
+
+
+class PageBlob(models.Model):
+    # Файл страницы, адресуемый по SHA-256 содержимого (pages/ab/cd/<sha256>.<ext>).
+    # Одинаковые страницы хранятся один раз; refcount — число MangaPage, ссылающихся на файл,
+    # блобы с нулём удаляет manage.py collect_page_blobs
+    sha256 = models.CharField(max_length=64, unique=True)
+    image = models.ImageField(max_length=255)
+    file_size = models.PositiveIntegerField()
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], name='pageblob_unreferenced_idx', condition=Q(refcount=0)),
+        ]
+
+    def __str__(self):
+        return self.image.name
+
+
+class RatingBucket(models.Model):
+    # Гистограмма оценок тайтла: число отзывов с оценкой, округлённой до целого 0–10
+    manga = models.ForeignKey(Manga, related_name='rating_buckets', on_delete=models.CASCADE)
+    bucket = models.PositiveSmallIntegerField(validators=[MaxValueValidator(10)])
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('manga', 'bucket')
+
+    def __str__(self):
+        return f"{self.manga_id}: {self.bucket} x {self.count}"
+
 
 class MangaPage(models.Model):
     manga = models.ForeignKey(Manga, related_name='pages', on_delete=models.CASCADE)
-    page_image = models.ImageField(upload_to=manga_pages_directory_path)
+    page_image = models.ImageField(upload_to=manga_pages_directory_path, max_length=255)
+    blob = models.ForeignKey(PageBlob, related_name='pages', null=True, blank=True, on_delete=models.PROTECT)
     volume = models.IntegerField(default=1)
     chapter = models.IntegerField(default=1)
     page_number = models.IntegerField(default=1)
     Chapter_Title = models.CharField(max_length=128, default="Chapter title")
+    # Метаданные изображения для манифеста главы, заполняются при загрузке
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    file_size = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
-        unique_together = ('manga', 'volume', 'chapter', 'page_image', 'Chapter_Title')
+        # Одинаковые страницы внутри главы указывают на один файл, поэтому уникален номер, а не путь
+        unique_together = ('manga', 'volume', 'chapter', 'Chapter_Title', 'page_number')
+        indexes = [
+            # Поиск страницы в MangaPageDetailView
+            models.Index(fields=['manga', 'volume', 'Chapter_Title', 'page_number'], name='mangapage_lookup_idx'),
+        ]
 
 
     def __str__(self):
@@ -140,6 +270,10 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ('user', 'manga')  # Один пользователь может оставить только один отзыв на одну мангу
+        indexes = [
+            # Лента отзывов тайтла: курсор по (created_at, id) в обе стороны
+            models.Index(fields=['manga', 'created_at', 'id'], name='review_manga_created_idx'),
+        ]
 
 
 class Person(models.Model):
@@ -166,3 +300,133 @@ class Person(models.Model):
 
     def __str__(self):
         return self.Nickname
+
+
+class CatalogVersion(models.Model):
+    # Версия каталога для ключей кеша лент (MangaLib/cache.py). Хранится в БД, а не в кеше:
+    # у каждого процесса свой LocMemCache, а эту строку видят все воркеры сразу после записи
+    version = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"Catalog v{self.version}"
+
+
+class ImageVariant(models.Model):
+    # Производные изображения (уменьшенные копии в WebP/JPEG) для обложек, фото персон и страниц
+    FORMAT_CHOICES = [
+        ('webp', 'image/webp'),
+        ('jpeg', 'image/jpeg'),
+    ]
+
+    source = models.CharField(max_length=255)  # имя исходного файла в хранилище
+    image = models.ImageField(max_length=255)
+    format = models.CharField(max_length=8, choices=FORMAT_CHOICES)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    file_size = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('source', 'format', 'width')
+
+    def __str__(self):
+        return f"{self.source} ({self.width}px, {self.format})"
+
+
+def ingest_upload_storage():
+    # Архивы в очереди лежат вне MEDIA_ROOT, чтобы их нельзя было скачать по /media/
+    return FileSystemStorage(location=settings.INGEST_UPLOAD_ROOT)
+
+
+class IngestJob(models.Model):
+    # Задача на распаковку главы; обрабатывается воркером manage.py run_ingest_worker
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Обрабатывается'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    manga = models.ForeignKey(Manga, related_name='ingest_jobs', on_delete=models.CASCADE)
+    created_by = models.ForeignKey(User, related_name='ingest_jobs', on_delete=models.CASCADE)
+    archive = models.FileField(upload_to='%Y/%m/%d/', storage=ingest_upload_storage, blank=True)
+    volume = models.IntegerField()
+    chapter = models.IntegerField()
+    chapter_title = models.CharField(max_length=128)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    pages_total = models.PositiveIntegerField(default=0)
+    pages_processed = models.PositiveIntegerField(default=0)
+    bytes_written = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # обновляется вместе с прогрессом
+    # Токен воркера, взявшего задачу; меняется при повторном захвате зависшей задачи
+    lease = models.CharField(max_length=32, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Воркеры выбирают самую старую задачу из очереди
+            models.Index(fields=['id'], name='ingestjob_queued_idx', condition=Q(status='queued')),
+        ]
+
+    def __str__(self):
+        return f"Ingest #{self.pk} {self.manga_id} volume {self.volume}, chapter {self.chapter} ({self.status})"
+
+
+class UploadSession(models.Model):
+    # Докачиваемая загрузка архива главы: куски пишутся по своим смещениям в один файл,
+    # после finalize файл уходит в очередь IngestJob
+    STATUS_OPEN = 'open'
+    STATUS_FINALIZED = 'finalized'
+    STATUS_CHOICES = [
+        (STATUS_OPEN, 'Загружается'),
+        (STATUS_FINALIZED, 'Завершена'),
+    ]
+
+    manga = models.ForeignKey(Manga, related_name='upload_sessions', on_delete=models.CASCADE)
+    created_by = models.ForeignKey(User, related_name='upload_sessions', on_delete=models.CASCADE)
+    volume = models.IntegerField()
+    chapter = models.IntegerField()
+    chapter_title = models.CharField(max_length=128)
+    total_size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    job = models.OneToOneField(IngestJob, related_name='upload_session', null=True, blank=True,
+                               on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def chunk_count(self):
+        return -(-self.total_size // self.chunk_size)
+
+    @property
+    def file_name(self):
+        # Имя в ingest_upload_storage
+        return f'sessions/{self.pk}.part'
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+    def __str__(self):
+        return f"Upload #{self.pk} {self.manga_id} volume {self.volume}, chapter {self.chapter} ({self.status})"
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, related_name='chunks', on_delete=models.CASCADE)
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ('session', 'index')
+
+    def __str__(self):
+        return f"Upload #{self.session_id} chunk {self.index}"
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Модуль выполняется в дочерних процессах пула, поэтому не импортирует Django:
+# все настройки передаются в process_page аргументами.
+
+ORIENTATION_TAG = 0x0112
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop')
+PAGE_FORMATS = ('JPEG', 'PNG', 'WEBP')
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Результат обработки страницы; format — итоговый формат файла, sha256 — хеш итоговых байтов
+PageResult = namedtuple('PageResult', 'width height file_size sha256 format error')
+
+
+def failed(error):
+    return PageResult(None, None, None, None, None, error)
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def page_result(path, image, fmt):
+    return PageResult(image.width, image.height, os.path.getsize(path), file_sha256(path), fmt, None)
+
+
+def save_page(image, path, fmt, quality, icc_profile):
+    # Пишем рядом и атомарно подменяем исходный файл
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as destination:
+            params = {'icc_profile': icc_profile} if icc_profile else {}
+            if fmt == 'JPEG':
+                if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+                    # Прозрачность в JPEG не сохранить: кладём страницу на белый фон
+                    background = Image.new('RGB', image.size, 'white')
+                    background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+                    image = background
+                elif image.mode != 'RGB':
+                    image = image.convert('RGB')
+                image.save(destination, 'JPEG', quality=quality, optimize=True, progressive=True, **params)
+            elif fmt == 'WEBP':
+                image.save(destination, 'WEBP', quality=quality, **params)
+            else:
+                image.save(destination, 'PNG', optimize=True, **params)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def process_page(path, reencode, quality, max_pixels):
+    # Полностью декодирует страницу, поворачивает по EXIF и убирает метаданные.
+    # Файл перезаписывается на месте; хеш считается здесь же, параллельно с другими страницами.
+    try:
+        with Image.open(path) as image:
+            if image.format not in PAGE_FORMATS:
+                return failed("Неподдерживаемый формат изображения.")
+            if image.width * image.height > max_pixels:
+                return failed("Слишком большое разрешение изображения.")
+
+            image.load()  # битые и обрезанные файлы падают здесь, а не у читателя
+            fmt = image.format
+            icc_profile = image.info.get('icc_profile')
+            orientation = image.getexif().get(ORIENTATION_TAG, 1)
+            has_metadata = any(image.info.get(key) for key in METADATA_KEYS)
+
+            if not reencode and orientation == 1 and not has_metadata:
+                return page_result(path, image, fmt)
+
+            page = ImageOps.exif_transpose(image)
+            fmt = 'JPEG' if reencode else fmt
+            save_page(page, path, fmt, quality, icc_profile)
+            return page_result(path, page, fmt)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+        return failed("Файл повреждён или не является изображением.")
+
+
+class InlinePool:
+    # Тот же интерфейс, что у ProcessPoolExecutor, но без дочерних процессов
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def page_pool(workers):
+    if workers <= 1:
+        return InlinePool()
+    return ProcessPoolExecutor(max_workers=workers)
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, FloatField, IntegerField, Value
+from django.db.models.functions import Cast, Floor, Greatest, Least, Round
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Manga, RatingBucket, Review
+
+HISTOGRAM_BUCKETS = range(11)
+
+
+def rating_average(rating_sum, rating_count):
+    # Средняя оценка с двумя знаками; при нуле отзывов — 0
+    return Round(
+        Cast(rating_sum, FloatField()) / Greatest(rating_count, Value(1)),
+        2,
+    )
+
+
+def bayesian_score(rating_sum, rating_count):
+    # (C * m + сумма) / (C + количество): один отзыв 10/10 не обгоняет сотню отзывов по 9.
+    # Тайтл без отзывов получает 0, а не априорную среднюю, и не попадает в топ
+    prior_weight = settings.RATING_PRIOR_WEIGHT
+    return Round(
+        (Value(float(prior_weight * settings.RATING_PRIOR_MEAN)) + Cast(rating_sum, FloatField()))
+        / (Value(float(prior_weight)) + rating_count)
+        * Least(rating_count, Value(1)),
+        4,
+    )
+
+
+def rating_bucket(rating):
+    # Столбец гистограммы: оценка, округлённая до целого (половина вверх)
+    return min(10, max(0, int(rating + 0.5)))
+
+
+def change_bucket(manga_id, bucket, delta):
+    # Строка столбца создаётся при первом отзыве; ignore_conflicts + F() не теряют
+    # инкременты при параллельных отзывах
+    if delta > 0:
+        RatingBucket.objects.bulk_create([RatingBucket(manga_id=manga_id, bucket=bucket)], ignore_conflicts=True)
+    RatingBucket.objects.filter(manga_id=manga_id, bucket=bucket).update(count=F('count') + delta)
+
+
+def apply_rating_change(manga_id, delta_sum, delta_count=0):
+    # Одно атомарное UPDATE без чтения в Python: правая часть SET видит значения строки
+    # до изменения, поэтому средняя и оценка считаются от уже обновлённых суммы и количества.
+    # Версия растёт тем же UPDATE: рейтинг входит в ETag карточки манги
+    new_sum = F('RatingSum') + delta_sum
+    new_count = F('RatingCount') + delta_count
+    return Manga.objects.filter(pk=manga_id).update(
+        RatingSum=new_sum,
+        RatingCount=new_count,
+        Rating=rating_average(new_sum, new_count),
+        Score=bayesian_score(new_sum, new_count),
+        version=F('version') + 1,
+        Updated_at=timezone.now(),
+    )
+
+
+def record_review_change(manga_id, old_rating=None, new_rating=None):
+    # old_rating=None — новый отзыв, new_rating=None — удалённый.
+    # Вызывается и из представления, и из сигнала удаления отзыва, поэтому кеши сбрасываются здесь
+    delta_sum = (new_rating or 0) - (old_rating or 0)
+    delta_count = (new_rating is not None) - (old_rating is not None)
+    apply_rating_change(manga_id, delta_sum, delta_count)
+    # Рейтинг и Score входят в карточки лент и каталога
+    bump_catalog_version()
+
+    old_bucket = rating_bucket(old_rating) if old_rating is not None else None
+    new_bucket = rating_bucket(new_rating) if new_rating is not None else None
+    if old_bucket != new_bucket:
+        if old_bucket is not None:
+            change_bucket(manga_id, old_bucket, -1)
+        if new_bucket is not None:
+            change_bucket(manga_id, new_bucket, 1)
+
+
+def rating_histogram(manga_id):
+    counts = dict(RatingBucket.objects.filter(manga_id=manga_id).values_list('bucket', 'count'))
+    return [counts.get(bucket, 0) for bucket in HISTOGRAM_BUCKETS]
+
+
+def rebuild_histograms():
+    # Гистограммы всех тайтлов заново одним GROUP BY по отзывам
+    buckets = (
+        Review.objects
+        .annotate(bucket=Least(Greatest(Cast(Floor(F('rating') + 0.5), IntegerField()), 0), 10))
+        .order_by()
+        .values('manga_id', 'bucket')
+        .annotate(count=Count('id'))
+    )
+    with transaction.atomic():
+        RatingBucket.objects.all().delete()
+        created = RatingBucket.objects.bulk_create(
+            [RatingBucket(manga_id=row['manga_id'], bucket=row['bucket'], count=row['count']) for row in buckets],
+            batch_size=1000,
+        )
+    return len(created)
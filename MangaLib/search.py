@@ -0,0 +1,77 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, Q
+
+from .models import Manga
+
+
+# Конфигурация полнотекстового поиска PostgreSQL: сайт русскоязычный,
+# английские слова этот словарь оставляет без изменений
+SEARCH_CONFIG = 'russian'
+
+# Поля, по которым можно искать отдельно (старые эндпоинты search/title|author|publisher/)
+SEARCH_FIELDS = {
+    'title': 'Title',
+    'author': 'Author',
+    'artist': 'Artist',
+    'publisher': 'Publisher',
+}
+
+# Изменение этих полей требует пересчёта search_vector
+SEARCH_VECTOR_SOURCE_FIELDS = {'Title', 'Author', 'Artist', 'Publisher', 'Description'}
+
+
+def manga_search_vector():
+    return (
+        SearchVector('Title', weight='A', config=SEARCH_CONFIG) +
+        SearchVector('Author', 'Artist', 'Publisher', weight='B', config=SEARCH_CONFIG) +
+        SearchVector('Description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def refresh_search_vector(manga_id):
+    if is_postgresql():
+        Manga.objects.filter(pk=manga_id).update(search_vector=manga_search_vector())
+
+
+def search_manga(queryset, query, field=None):
+    # field=None — полнотекстовый поиск по всем полям, иначе поиск по одному полю из SEARCH_FIELDS
+    if not is_postgresql():
+        return _fallback_search(queryset, query, field)
+
+    if field is not None:
+        # word similarity (оператор %>) находит и подстроки, и слова с опечатками,
+        # и, в отличие от UPPER(...) LIKE, обслуживается GIN-индексом gin_trgm_ops
+        column = SEARCH_FIELDS[field]
+        return (
+            queryset
+            .filter(**{f'{column}__trigram_word_similar': query})
+            .annotate(similarity=TrigramWordSimilarity(query, column))
+            .order_by('-similarity', '-RatingCount', '-id')
+        )
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    return (
+        queryset
+        .filter(Q(search_vector=search_query) | Q(Title__trigram_word_similar=query))
+        .annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+            similarity=TrigramWordSimilarity(query, 'Title'),
+        )
+        .order_by('-rank', '-similarity', '-RatingCount', '-id')
+    )
+
+
+def _fallback_search(queryset, query, field=None):
+    # Для SQLite (тесты и локальная разработка): подстрочный поиск без ранжирования
+    if field is not None:
+        condition = Q(**{f'{SEARCH_FIELDS[field]}__icontains': query})
+    else:
+        condition = Q()
+        for column in SEARCH_VECTOR_SOURCE_FIELDS:
+            condition |= Q(**{f'{column}__icontains': query})
+    return queryset.filter(condition).order_by('-RatingCount', '-id')
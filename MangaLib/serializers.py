@@ -1,9 +1,12 @@
 import os
 import shutil
 import zipfile
+from django.conf import settings
 from django.contrib.auth.hashers import make_password, is_password_usable
+from django.db.models import Prefetch
 from rest_framework import serializers
-from MangaLib.models import Manga, User, Review, Category, MangaPage, News, Person
+from MangaLib.images import generate_variants
+from MangaLib.models import Manga, User, Review, Category, MangaPage, News, Person, IngestJob, UploadSession
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -16,6 +19,15 @@ class ReviewSerializer(serializers.ModelSerializer):
         model = Review
         fields = ['id', 'user', 'user_profile_image', 'text', 'rating', 'created_at', 'manga_id', 'manga_title']
 
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        # Пользователь и манга одним JOIN вместо двух запросов на каждый отзыв
+        return queryset.select_related('user', 'manga').only(
+            'id', 'text', 'rating', 'created_at',
+            'user__id', 'user__username', 'user__profile_image',
+            'manga__id', 'manga__Title',
+        )
+
     def get_user_profile_image(self, obj):
         if obj.user.profile_image:
             return obj.user.profile_image.url
@@ -28,85 +40,12 @@ class MangaZipSerializer(serializers.Serializer):
     chapter = serializers.IntegerField()
     chapter_title = serializers.CharField()
 
-    def create(self, validated_data):
-        # Получаем ID манги из контекста
-        manga_id = self.context.get('manga_id')
-        if not manga_id:
-            raise serializers.ValidationError("ID манги не передан в контексте.")
-
-        # Находим мангу по ID
-        try:
-            manga = Manga.objects.get(id=manga_id)
-        except Manga.DoesNotExist:
-            raise serializers.ValidationError("Манга с таким ID не существует.")
-
-        # Получаем полное название манги
-        manga_title = manga.Title
-        if not manga_title:
-            raise serializers.ValidationError("Название манги не указано.")
-
-        # Основной путь для манги
-        manga_dir = os.path.join('media/manga', manga_title)
-
-        # Получаем название тома и главы
-        volume = validated_data.get('volume')
-        chapter = validated_data.get('chapter')
-        chapter_title = validated_data.get('chapter_title')
-
-        # Создаем папки для обложки, томов и глав с использованием полного названия главы
-        cover_dir = os.path.join(manga_dir, 'cover')
-        volume_dir = os.path.join(manga_dir, f'volume_{volume}')
-        # Папка главы теперь будет включать полное название главы
-        chapter_dir = os.path.join(volume_dir, f'{chapter_title}')
-
-        # Убедитесь, что папки созданы
-        os.makedirs(cover_dir, exist_ok=True)
-        os.makedirs(volume_dir, exist_ok=True)
-        os.makedirs(chapter_dir, exist_ok=True)
-
-        # Распаковываем ZIP файл
-        zip_file = validated_data.get('zip_file')
-        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-            # Сначала ищем обложку
-            cover_image = None
-            for file_name in zip_ref.namelist():
-                if file_name.lower().endswith(('cover.jpg', 'cover.jpeg', 'cover.png')):
-                    cover_image = zip_ref.read(file_name)
-                    break
-
-            # Сохраняем обложку, если она найдена
-            if cover_image:
-                cover_path = os.path.join(cover_dir, 'cover.jpg')
-                with open(cover_path, 'wb') as f:
-                    f.write(cover_image)
-                # Обновляем поле обложки в модели
-                manga.Image = f'manga/{manga_title}/cover/cover.jpg'
-                manga.save()
-
-            # Сохраняем страницы манги с нумерацией
-            image_files = sorted([file_name for file_name in zip_ref.namelist() if
-                                  file_name.endswith(('.jpg', '.jpeg', '.png')) and 'cover' not in file_name.lower()])
-
-            for index, file_name in enumerate(image_files, start=1):
-                file_data = zip_ref.read(file_name)
-                new_file_name = f"{index}.jpg"
-                file_path = os.path.join(chapter_dir, new_file_name)
-
-                # Сохраняем файл
-                with open(file_path, 'wb') as f:
-                    f.write(file_data)
-
-                # Создаем объект страницы манги
-                MangaPage.objects.create(
-                    manga=manga,
-                    volume=volume,
-                    chapter=chapter,
-                    page_number=index,
-                    page_image=f'manga/{manga_title}/volume_{volume}/{chapter_title}/{new_file_name}',
-                    Chapter_Title=chapter_title  # Сохраняем название главы в поле модели
-                )
-
-        return manga
+    def validate_zip_file(self, value):
+        # Битый архив отклоняем сразу, не дожидаясь воркера
+        if not zipfile.is_zipfile(value):
+            raise serializers.ValidationError("Файл не является ZIP-архивом.")
+        value.seek(0)
+        return value
 
     def get_Image(self, obj):
         # Приведение пути к относительному формату
@@ -116,6 +55,28 @@ class MangaZipSerializer(serializers.Serializer):
         return None
 
 
+class IngestJobSerializer(serializers.ModelSerializer):
+    manga_id = serializers.ReadOnlyField(source='manga.id')
+
+    class Meta:
+        model = IngestJob
+        fields = ['id', 'manga_id', 'volume', 'chapter', 'chapter_title', 'status', 'pages_total',
+                  'pages_processed', 'bytes_written', 'error', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    manga_id = serializers.ReadOnlyField(source='manga.id')
+    chunk_count = serializers.ReadOnlyField()
+    job_id = serializers.ReadOnlyField(source='job.id', default=None)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'manga_id', 'volume', 'chapter', 'chapter_title', 'total_size', 'chunk_size',
+                  'chunk_count', 'status', 'job_id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'chunk_size', 'status', 'created_at', 'updated_at']
+
+
 class MangaSerializer(serializers.ModelSerializer):
     categories = serializers.ListField(
         child=serializers.CharField(max_length=64),
@@ -129,7 +90,6 @@ class MangaSerializer(serializers.ModelSerializer):
     Mod_status = serializers.ChoiceField(choices=Manga.MOD_CHOICES, read_only=True)
     Mod_date = serializers.DateTimeField(read_only=True)
 
-    Chapters = serializers.SerializerMethodField()
     Url_message = serializers.ListField(
         child=serializers.URLField(),
         required=False,
@@ -144,16 +104,11 @@ class MangaSerializer(serializers.ModelSerializer):
             "RatingCount", "categories_display", "Created_at", "Publisher", "Mod_status", "Mod_date", "Mod_message",
             "Url_message","Created_by"
         )
-        read_only_fields = ("id", "Rating", "RatingCount", "Mod_status", "Mod_date")
+        read_only_fields = ("id", "Rating", "RatingCount", "Chapters", "Mod_status", "Mod_date")
 
     def get_categories_display(self, obj):
         return [category.name for category in obj.Category.all()]
 
-    def get_Chapters(self, obj):
-        # Считаем количество уникальных глав для этой манги
-        chapters_count = MangaPage.objects.filter(manga=obj).values('volume', 'chapter').distinct().count()
-        return chapters_count
-
     def create(self, validated_data):
         categories_data = validated_data.pop('categories', [])
         url_message_data = validated_data.pop('Url_message', [])
@@ -177,13 +132,17 @@ class MangaSerializer(serializers.ModelSerializer):
 
             shutil.move(old_image_path, new_image_path)
             manga.Image.name = os.path.join('Manga', manga.Title, 'cover', 'cover.jpg')
-            manga.save()
+            manga.save(update_fields=['Image'])
+            generate_variants(manga.Image.name, settings.COVER_VARIANT_WIDTHS)
 
         return manga
 
     def update(self, instance, validated_data):
         old_title = instance.Title
         new_title = validated_data.get('Title', old_title)
+        # Сохраняем только изменённые поля: счётчики, рейтинг и версию пишут атомарные UPDATE,
+        # и полное сохранение строки вернуло бы их устаревшие значения
+        update_fields = set(validated_data) - {'categories'}
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
@@ -207,11 +166,13 @@ class MangaSerializer(serializers.ModelSerializer):
                     shutil.move(old_image_full_path, new_image_full_path)
 
                 instance.Image.name = new_image_path
+                update_fields.add('Image')
 
         if 'Image' in validated_data:
             new_image = validated_data['Image']
 
-            manga_dir = os.path.join('media/Manga', instance.Title)
+            # Обложка пишется в MEDIA_ROOT по тому же пути, что и в create()
+            manga_dir = os.path.join(settings.MANGA_MEDIA_ROOT, instance.Title)
             cover_dir = os.path.join(manga_dir, 'cover')
 
             if os.path.exists(cover_dir):
@@ -228,7 +189,9 @@ class MangaSerializer(serializers.ModelSerializer):
                 for chunk in new_image.chunks():
                     destination.write(chunk)
 
-            instance.Image.name = os.path.join(instance.Title, 'cover', 'cover.jpg')
+            # Строка, а не загруженный файл: иначе при save() FileField сохранит загрузку ещё раз
+            # под своим именем, и в базе окажется не тот файл, что лежит в cover/
+            instance.Image = os.path.join('Manga', instance.Title, 'cover', 'cover.jpg')
 
         url_message_data = validated_data.pop('Url_message', None)
 
@@ -243,7 +206,9 @@ class MangaSerializer(serializers.ModelSerializer):
                 category, created = Category.objects.get_or_create(name=category_name)
                 instance.Category.add(category)
 
-        instance.save()
+        instance.save(update_fields=update_fields)
+        if 'Image' in validated_data:
+            generate_variants(instance.Image.name, settings.COVER_VARIANT_WIDTHS)
 
         return instance
 
@@ -262,6 +227,32 @@ class MangaSerializer(serializers.ModelSerializer):
         return ret
 
 
+class MangaCardSerializer(serializers.ModelSerializer):
+    # Облегчённая карточка для списков: без описания, ссылок и полей модерации
+    categories_display = serializers.SerializerMethodField()
+    Image = serializers.ImageField(read_only=True)
+
+    # Колонки, которые грузим помимо полей карточки: по ним сортируют списки и строится курсор
+    sort_fields = ("RatingCount", "Score", "Release", "Created_at", "bookmark_count")
+
+    class Meta:
+        model = Manga
+        fields = ("id", "Title", "Image", "Status", "Rating", "Chapters", "categories_display")
+        read_only_fields = fields
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        # Только нужные колонки и категории одним запросом на всю страницу
+        return queryset.only(
+            "id", "Title", "Image", "Status", "Rating", "Chapters", *cls.sort_fields
+        ).prefetch_related(
+            Prefetch('Category', queryset=Category.objects.only('name'))
+        )
+
+    def get_categories_display(self, obj):
+        return [category.name for category in obj.Category.all()]
+
+
 class UserSerializer(serializers.ModelSerializer):
     bookmarks = MangaSerializer(many=True, read_only=True)
     reviews = ReviewSerializer(many=True, read_only=True)
@@ -286,6 +277,23 @@ class UserSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class BookmarkBatchSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list,
+                                max_length=settings.BOOKMARK_BATCH_MAX_SIZE)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list,
+                                   max_length=settings.BOOKMARK_BATCH_MAX_SIZE)
+
+    def validate(self, data):
+        if set(data['add']) & set(data['remove']):
+            raise serializers.ValidationError("Манга не может быть одновременно добавлена и удалена.")
+        return data
+
+
+class MangaIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                max_length=settings.ME_STATE_MAX_IDS)
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
@@ -0,0 +1,98 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .blobs import release_blob
+from .counters import MANGA_COUNTER_FIELDS, change_manga_counter
+from .models import Manga, MangaPage, Person, Review, User
+from .ratings import record_review_change
+from .search import SEARCH_VECTOR_SOURCE_FIELDS, refresh_search_vector
+from .suggest import suggest_index
+
+
+def existing_links(through, instance, reverse, pk_set):
+    # Связи, которые реально будут удалены: remove() сообщает все переданные id,
+    # даже если части из них нет. select_for_update не даёт двум параллельным
+    # удалениям одной связи дважды уменьшить счётчик.
+    if reverse:
+        links = through.objects.filter(manga_id=instance.pk)
+        if pk_set is not None:
+            links = links.filter(user_id__in=pk_set)
+    else:
+        links = through.objects.filter(user_id=instance.pk)
+        if pk_set is not None:
+            links = links.filter(manga_id__in=pk_set)
+    return list(links.select_for_update().values_list('manga_id', flat=True))
+
+
+@receiver(m2m_changed, sender=User.bookmarks.through)
+@receiver(m2m_changed, sender=User.favourite.through)
+def sync_manga_counters(sender, instance, action, reverse, pk_set, **kwargs):
+    field = MANGA_COUNTER_FIELDS[sender]
+
+    if action == 'post_add':
+        # Для post_add Django передаёт только действительно добавленные id
+        if reverse:
+            change_manga_counter(field, [instance.pk], len(pk_set))
+        else:
+            change_manga_counter(field, pk_set, 1)
+    elif action in ('pre_remove', 'pre_clear'):
+        # pre_* и удаление строк выполняются в одной транзакции менеджера
+        manga_ids = existing_links(sender, instance, reverse, pk_set)
+        if reverse:
+            change_manga_counter(field, [instance.pk], -len(manga_ids))
+        else:
+            change_manga_counter(field, manga_ids, -1)
+
+
+@receiver(pre_delete, sender=User)
+def release_user_counters(sender, instance, **kwargs):
+    # Каскадное удаление строк связей не отправляет m2m_changed
+    for through, field in MANGA_COUNTER_FIELDS.items():
+        manga_ids = list(through.objects.filter(user_id=instance.pk).values_list('manga_id', flat=True))
+        change_manga_counter(field, manga_ids, -1)
+
+
+@receiver(post_save, sender=Manga)
+def sync_search_vector(sender, instance, update_fields=None, **kwargs):
+    # Сохранения служебных полей (например, счётчика глав) не трогают текстовые колонки
+    if update_fields is not None and not SEARCH_VECTOR_SOURCE_FIELDS.intersection(update_fields):
+        return
+    refresh_search_vector(instance.pk)
+
+
+@receiver(post_save, sender=Manga)
+def sync_manga_suggestions(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'Title', 'Image', 'Moderation_status'}.intersection(update_fields):
+        return
+    suggest_index.update_manga(instance)
+
+
+@receiver(post_save, sender=Person)
+def sync_person_suggestions(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'Nickname', 'profile_image', 'Moderation_status'}.intersection(update_fields):
+        return
+    suggest_index.update_person(instance)
+
+
+@receiver(post_delete, sender=Manga)
+def drop_manga_suggestions(sender, instance, **kwargs):
+    suggest_index.update(('manga', instance.pk), None)
+
+
+@receiver(post_delete, sender=Person)
+def drop_person_suggestions(sender, instance, **kwargs):
+    suggest_index.update(('person', instance.pk), None)
+
+
+@receiver(post_delete, sender=MangaPage)
+def release_page_blob(sender, instance, **kwargs):
+    # Файл страницы остаётся на диске, пока на него ссылаются другие главы;
+    # блобы без ссылок удаляет manage.py collect_page_blobs
+    release_blob(instance.blob_id)
+
+
+@receiver(post_delete, sender=Review)
+def release_review_rating(sender, instance, **kwargs):
+    # Удалённый отзыв (в том числе вместе с пользователем) вычитается из суммы, количества и гистограммы,
+    # версии манги и каталога растут там же, в record_review_change
+    record_review_change(instance.manga_id, old_rating=instance.rating)
@@ -0,0 +1,165 @@
+import bisect
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Manga, Person
+
+
+NON_WORD_RE = re.compile(r'[^\w]+')
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    # Регистр, ё/е и пунктуация не должны влиять на подсказки
+    text = text.casefold().replace('ё', 'е')
+    return ' '.join(NON_WORD_RE.sub(' ', text).split())
+
+
+def image_url(image):
+    return image.url if image else None
+
+
+def manga_entry(manga):
+    return {'id': manga.pk, 'title': manga.Title, 'cover': image_url(manga.Image), 'type': 'manga'}
+
+
+def person_entry(person):
+    return {'id': person.pk, 'title': person.Nickname, 'cover': image_url(person.profile_image), 'type': 'person'}
+
+
+def index_keys(title, ref):
+    # Ключ на каждое слово: "piece" находит "One Piece"
+    words = normalize(title).split(' ')
+    if words == ['']:
+        return []
+    return [(' '.join(words[i:]), *ref) for i in range(len(words))]
+
+
+class SuggestIndex:
+    # Отсортированный массив ключей (нормализованный текст, тип, id) в памяти процесса.
+    # Префиксный поиск — bisect, без обращения к БД.
+    # Процесс обновляет индекс по своим сигналам сразу, а изменения из других
+    # процессов подхватывает полной пересборкой раз в SUGGEST_INDEX_TTL секунд.
+    # Пересборка по TTL идёт в фоновом потоке: запросы тем временем читают старый индекс.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = {}
+        self._entry_keys = {}
+        self._built_at = None
+        self._refreshing = False
+        self._pending = {}  # ref -> entry: изменения по сигналам, пока идёт фоновая пересборка
+
+    def rebuild(self):
+        entries = {}
+        for manga in Manga.objects.filter(Moderation_status='approved').only('id', 'Title', 'Image'):
+            entries[('manga', manga.pk)] = manga_entry(manga)
+        for person in Person.objects.filter(Moderation_status='approved').only('id', 'Nickname', 'profile_image'):
+            entries[('person', person.pk)] = person_entry(person)
+
+        keys = []
+        entry_keys = {}
+        for ref, entry in entries.items():
+            entry_keys[ref] = index_keys(entry['title'], ref)
+            keys.extend(entry_keys[ref])
+        keys.sort()
+
+        with self._lock:
+            self._keys = keys
+            self._entries = entries
+            self._entry_keys = entry_keys
+            self._built_at = time.monotonic()
+            # Выборка могла не увидеть изменения, пришедшие по сигналам во время пересборки
+            pending, self._pending = self._pending, {}
+            for ref, entry in pending.items():
+                self._apply(ref, entry)
+
+    def ensure_built(self):
+        if self._built_at is None:
+            # Первый запрос процесса: отдавать пока нечего, строим сразу
+            self.rebuild()
+        elif time.monotonic() - self._built_at > settings.SUGGEST_INDEX_TTL:
+            self.refresh_in_background()
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='suggest-index-refresh', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.rebuild()
+        except Exception:
+            # Старый индекс остаётся, следующий запрос попробует снова
+            logger.exception('Suggest index rebuild failed')
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._pending = {}
+            # Соединение с БД принадлежит этому потоку, сам Django его не закроет
+            connections.close_all()
+
+    def search(self, query, limit):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        self.ensure_built()
+
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                key = self._keys[i]
+                if not key[0].startswith(prefix):
+                    break
+                ref = key[1:]
+                if ref not in seen:
+                    seen.add(ref)
+                    results.append(self._entries[ref])
+                i += 1
+        return results
+
+    def update(self, ref, entry):
+        # entry=None удаляет запись. Пока индекс не построен, менять нечего:
+        # первая выборка и так прочитает актуальные данные
+        if self._built_at is None:
+            return
+        with self._lock:
+            if self._refreshing:
+                self._pending[ref] = entry
+            self._apply(ref, entry)
+
+    def _apply(self, ref, entry):
+        # Вызывается под self._lock
+        for key in self._entry_keys.pop(ref, []):
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+        self._entries.pop(ref, None)
+
+        if entry is not None:
+            self._entries[ref] = entry
+            self._entry_keys[ref] = index_keys(entry['title'], ref)
+            for key in self._entry_keys[ref]:
+                bisect.insort(self._keys, key)
+
+    def update_manga(self, manga):
+        entry = manga_entry(manga) if manga.Moderation_status == 'approved' else None
+        self.update(('manga', manga.pk), entry)
+
+    def update_person(self, person):
+        entry = person_entry(person) if person.Moderation_status == 'approved' else None
+        self.update(('person', person.pk), entry)
+
+
+suggest_index = SuggestIndex()
@@ -1,3 +1,939 @@
-from django.test import TestCase
+import base64
+import datetime
+import hashlib
+import importlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from PIL import Image
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from .blobs import acquire_blobs, blob_name, blob_path, collect_unreferenced_blobs
+from .bookmarks import change_bookmarks, toggle_bookmark
+from .cache import bump_catalog_version, cached_feed, get_catalog_version
+from .images import generate_variants
+from .ingest import ingest_chapter_archive
+from .jobs import claim_next_job, run_job
+from .media import serve_media
+from .models import (
+    CatalogVersion, ImageVariant, IngestJob, Manga, MangaPage, PageBlob, Review, UploadSession, User,
+    ingest_upload_storage,
+)
+from .pages import PageResult
+from .ratings import rating_histogram
+from .serializers import MangaCardSerializer, MangaSerializer
+from .suggest import SuggestIndex
+from .uploads import (
+    finalize_session, missing_chunks, open_session, purge_abandoned_sessions, session_path, write_chunk,
+)
+from .views import CATALOG_SORT_ORDERING
+
+
+def create_manga(title='Manga', **fields):
+    fields.setdefault('Moderation_status', 'approved')
+    fields.setdefault('Release', datetime.date(2020, 1, 1))
+    return Manga.objects.create(Title=title, Author='Author', Artist='Artist', Status='Выходит', **fields)
+
+
+def jpeg_bytes(size=(40, 60), color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def chapter_archive(pages):
+    # pages: список цветов, по странице на цвет
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for index, color in enumerate(pages, start=1):
+            archive.writestr(f'{index:03d}.jpg', jpeg_bytes(color=color))
+    return buffer.getvalue()
+
+
+def migration(name):
+    return importlib.import_module(f'MangaLib.migrations.{name}')
+
+
+def encode_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+
+class CatalogCursorTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for index in range(5):
+            create_manga(f'Manga {index}', Release=datetime.date(2020, 1, index + 1))
+
+    def catalog(self, sort_by, cursor=None):
+        data = {'sort_by': sort_by, 'page_size': 2}
+        if cursor is not None:
+            data['cursor'] = cursor
+        return self.client.post('/api/catalog/', data, format='json')
+
+    def test_pages_follow_next_cursor(self):
+        titles = []
+        cursor = None
+        while True:
+            response = self.catalog('release_date', cursor)
+            self.assertEqual(response.status_code, 200)
+            titles += [card['Title'] for card in response.data['results']]
+            cursor = response.data['next']
+            if cursor is None:
+                break
+        self.assertEqual(titles, [f'Manga {index}' for index in reversed(range(5))])
+
+    def test_malformed_cursor_is_rejected(self):
+        manga_id = Manga.objects.order_by('id').first().id
+        cursors = [
+            'not base64 !',
+            encode_cursor({'value': '2020-01-01', 'id': manga_id}),
+            encode_cursor(['2020-01-01']),
+            encode_cursor(['2020-01-01', manga_id, 1]),
+            encode_cursor(['2020-01-01', 'abc']),
+            encode_cursor(['2020-01-01', True]),
+            encode_cursor(['not a date', manga_id]),
+            encode_cursor([{'date': '2020-01-01'}, manga_id]),
+            encode_cursor([None, manga_id]),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.catalog('release_date', cursor).status_code, 404)
+
+    def test_cursor_value_must_match_sort_field(self):
+        manga_id = Manga.objects.order_by('id').first().id
+        self.assertEqual(self.catalog('rating', encode_cursor(['high', manga_id])).status_code, 404)
+        self.assertEqual(self.catalog('update_date', encode_cursor([123, manga_id])).status_code, 404)
+        self.assertEqual(self.catalog('rating', encode_cursor([5, manga_id])).status_code, 200)
+
+
+class ChapterCountMigrationTests(TestCase):
+    def test_counts_distinct_volume_chapter_pairs(self):
+        manga = create_manga()
+        empty = create_manga('Empty')
+        for volume, chapter, page_number in [(1, 1, 1), (1, 1, 2), (1, 2, 1), (2, 1, 1)]:
+            MangaPage.objects.create(
+                manga=manga, volume=volume, chapter=chapter, page_number=page_number,
+                page_image=f'pages/{volume}-{chapter}-{page_number}.jpg',
+            )
+        Manga.objects.filter(pk=manga.pk).update(Chapters=0)
+        Manga.objects.filter(pk=empty.pk).update(Chapters=7)
+
+        migration('0038_rebuild_manga_chapters').rebuild_chapter_counts(apps, None)
+
+        manga.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(manga.Chapters, 3)
+        self.assertEqual(empty.Chapters, 0)
+
+
+class MangaSaveTests(TestCase):
+    # Счётчики и рейтинг меняются атомарными UPDATE, пока объект манги уже загружен в память
+    counters = {'bookmark_count': 5, 'favourite_count': 2, 'RatingSum': 16.0, 'RatingCount': 2,
+                'Rating': 8.0, 'Score': 7.17, 'version': 4}
+
+    def assert_counters_kept(self, manga, **expected):
+        manga.refresh_from_db()
+        for field, value in dict(self.counters, **expected).items():
+            self.assertEqual(getattr(manga, field), value, field)
+
+    def test_serializer_update_keeps_counters(self):
+        manga = create_manga()
+        Manga.objects.filter(pk=manga.pk).update(**self.counters)
+
+        serializer = MangaSerializer(manga, data={'Description': 'New description'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        self.assert_counters_kept(manga)
+        self.assertEqual(manga.Description, 'New description')
+
+    def test_approve_keeps_counters(self):
+        manga = create_manga(Moderation_status='pending')
+        admin = User.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        get = Manga.objects.get
+
+        def get_then_update_counters(*args, **kwargs):
+            instance = get(*args, **kwargs)
+            Manga.objects.filter(pk=instance.pk).update(**self.counters)
+            return instance
+
+        with mock.patch.object(Manga.objects, 'get', side_effect=get_then_update_counters):
+            response = client.post(f'/api/{manga.pk}/approve_manga/', {'action': 'approve'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.assert_counters_kept(manga, version=self.counters['version'] + 1)
+        self.assertEqual(manga.Moderation_status, 'approved')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN plans are checked on PostgreSQL only')
+class ListingIndexTests(TestCase):
+    # Частичные индексы из user-004: на заполненной таблице планировщик должен
+    # выбирать их для каждой сортировки публичных списков и для очереди модерации
+    catalog_indexes = {
+        'popularity': 'manga_approved_popularity_idx',
+        'rating': 'manga_approved_rating_idx',
+        'chapters': 'manga_approved_chapters_idx',
+        'release_date': 'manga_approved_release_idx',
+        'update_date': 'manga_approved_created_idx',
+        'add_date': 'manga_approved_id_idx',
+        'title_az': 'manga_approved_title_idx',
+        'title_za': 'manga_approved_title_idx',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        statuses = ['approved'] * 8 + ['pending', 'rejected']
+        Manga.objects.bulk_create([
+            Manga(
+                Title=f'Manga {index:05d}', Author='Author', Artist='Artist', Status='Выходит',
+                Release=datetime.date(2000, 1, 1) + datetime.timedelta(days=index % 9000),
+                Moderation_status=statuses[index % len(statuses)],
+                Chapters=index % 300, Rating=index % 100 / 10, Score=index % 97 / 10,
+                bookmark_count=index % 1000,
+            )
+            for index in range(20000)
+        ], batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE "{Manga._meta.db_table}"')
+
+    def assert_uses_index(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_catalog_sorts_use_partial_indexes(self):
+        approved = MangaCardSerializer.prepare_queryset(Manga.objects.filter(Moderation_status='approved'))
+        for sort_by, ordering in CATALOG_SORT_ORDERING.items():
+            with self.subTest(sort_by=sort_by):
+                prefix = '-' if ordering.startswith('-') else ''
+                queryset = approved.order_by(ordering, f'{prefix}id')[:21]
+                self.assert_uses_index(queryset, self.catalog_indexes[sort_by])
+
+    def test_popular_uses_score_index(self):
+        queryset = Manga.objects.filter(Moderation_status='approved').order_by('-Score', '-id')[:6]
+        self.assert_uses_index(queryset, 'manga_approved_score_idx')
+
+    def test_moderation_queue_uses_pending_index(self):
+        queryset = Manga.objects.filter(Moderation_status='pending').order_by('Created_at')[:20]
+        self.assert_uses_index(queryset, 'manga_pending_created_idx')
+
+
+class CatalogVersionTests(TestCase):
+    def test_version_is_shared_through_database(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            return len(builds)
+
+        self.assertEqual(cached_feed('popular', [], None, build), 1)
+        self.assertEqual(cached_feed('popular', [], None, build), 1)
+
+        # Версию поднял другой воркер: его кеш недоступен, общая только строка в БД
+        version = get_catalog_version()
+        CatalogVersion.objects.update(version=version + 1)
+        self.assertEqual(cached_feed('popular', [], None, build), 2)
+
+        bump_catalog_version()
+        self.assertEqual(get_catalog_version(), version + 2)
+        self.assertEqual(cached_feed('popular', [], None, build), 3)
+
+
+class ServeMediaTests(SimpleTestCase):
+    content = b'0123456789'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.media_root = os.path.join(self.tmp_dir.name, 'media')
+        os.makedirs(os.path.join(self.media_root, 'Manga', 'Тест'))
+        with open(os.path.join(self.media_root, 'Manga', 'Тест', 'page.txt'), 'wb') as f:
+            f.write(self.content)
+        # Файл рядом с MEDIA_ROOT, который не должен отдаваться ни по какому пути
+        with open(os.path.join(self.tmp_dir.name, 'secret.txt'), 'wb') as f:
+            f.write(b'secret')
+
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, FILE_DELIVERY_BACKEND='inline')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = RequestFactory()
+
+    def serve(self, name='Manga/Тест/page.txt', **headers):
+        return serve_media(self.factory.get('/media/', headers=headers), name)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_inline_response(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'])
+        self.assertIn('Last-Modified', response)
+
+    def test_if_none_match_returns_304(self):
+        etag = self.serve()['ETag']
+        response = self.serve(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_range_returns_206(self):
+        response = self.serve(range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+        response = self.serve(range='bytes=-3')
+        self.assertEqual(self.body(response), b'789')
+
+    def test_unsatisfiable_range_returns_416(self):
+        response = self.serve(range='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_invalid_range_is_ignored(self):
+        # last-pos < first-pos: заголовок игнорируется, отдаётся весь файл (RFC 9110, 14.1.1)
+        response = self.serve(range='bytes=5-3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_content_addressed_etag_comes_from_name(self):
+        sha256 = 'ab' * 32
+        name = f'pages/ab/ab/{sha256}.jpg'
+        os.makedirs(os.path.join(self.media_root, 'pages', 'ab', 'ab'))
+        with open(os.path.join(self.media_root, name), 'wb') as f:
+            f.write(self.content)
+
+        with mock.patch('MangaLib.media.file_etag') as file_etag:
+            response = self.serve(name)
+        file_etag.assert_not_called()
+        self.assertEqual(response['ETag'], f'"{sha256}"')
+        self.assertEqual(self.serve(name, if_none_match=f'"{sha256}"').status_code, 304)
+
+    def test_if_range_mismatch_returns_whole_file(self):
+        response = self.serve(range='bytes=2-5', if_range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    @override_settings(FILE_DELIVERY_BACKEND='nginx', FILE_DELIVERY_NGINX_PREFIX='/protected-media/')
+    def test_nginx_backend(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/Manga/%D0%A2%D0%B5%D1%81%D1%82/page.txt')
+        self.assertEqual(response.content, b'')
+        self.assertTrue(response['ETag'])
+
+        response = self.serve(if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(FILE_DELIVERY_BACKEND='apache')
+    def test_apache_backend(self):
+        response = self.serve()
+        path = os.path.realpath(os.path.join(self.media_root, 'Manga', 'Тест', 'page.txt'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], path.encode('utf-8').decode('latin-1'))
+        self.assertEqual(response.content, b'')
+
+    def test_paths_outside_media_root_are_rejected(self):
+        names = [
+            '../secret.txt',
+            'Manga/../../secret.txt',
+            os.path.join(self.tmp_dir.name, 'secret.txt'),
+            'Manga/Тест',
+            'Manga/Тест/missing.txt',
+        ]
+        for name in names:
+            with self.subTest(name=name):
+                with self.assertRaises(Http404):
+                    self.serve(name)
+
+    def test_media_url_rejects_traversal(self):
+        response = self.client.get('/media/Manga/../../secret.txt')
+        self.assertEqual(response.status_code, 404)
+
+
+class CoverUploadTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        media_root = self.tmp_dir.name
+        settings_override = override_settings(MEDIA_ROOT=media_root, MANGA_MEDIA_ROOT=os.path.join(media_root, 'Manga'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def cover_upload(self, color):
+        return SimpleUploadedFile('upload.jpg', jpeg_bytes((600, 900), color), content_type='image/jpeg')
+
+    def test_updated_cover_is_stored_and_gets_variants(self):
+        manga = create_manga('Cover')
+        for color in ('red', 'blue'):
+            serializer = MangaSerializer(manga, data={'Image': self.cover_upload(color)}, partial=True)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            serializer.save()
+
+        manga.refresh_from_db()
+        self.assertEqual(manga.Image.name, 'Manga/Cover/cover/cover.jpg')
+        # Повторная загрузка перезаписывает cover.jpg, а не копит cover_<suffix>.jpg рядом
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir.name, 'Manga', 'Cover', 'cover')), ['cover.jpg'])
+        with Image.open(manga.Image.path) as cover:
+            self.assertGreater(cover.getpixel((0, 0))[2], 200)  # последняя загрузка — синяя
+        self.assertEqual(
+            ImageVariant.objects.filter(source=manga.Image.name).count(),
+            len([width for width in settings.COVER_VARIANT_WIDTHS if width < 600]) * len(settings.IMAGE_VARIANT_FORMATS),
+        )
+
+    def test_missing_source_is_logged(self):
+        with self.assertLogs('MangaLib.images', level='WARNING'):
+            self.assertEqual(generate_variants('Manga/missing/cover/cover.jpg', settings.COVER_VARIANT_WIDTHS), [])
+
+
+class MangaUploadViewTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.manga = create_manga('Upload', Created_by='owner')
+        self.client = APIClient()
+
+    def upload(self, username, manga_id):
+        user = User.objects.create(username=username, email=f'{username}@example.com')
+        self.client.force_authenticate(user)
+        archive = SimpleUploadedFile('chapter.zip', chapter_archive(['red']), content_type='application/zip')
+        return self.client.post(f'/api/upload_manga/{manga_id}/', {
+            'zip_file': archive, 'volume': 1, 'chapter': 1, 'chapter_title': 'Chapter',
+        }, format='multipart')
+
+    def test_unknown_manga_is_404(self):
+        self.assertEqual(self.upload('owner', self.manga.pk + 1).status_code, 404)
+
+    def test_non_owner_is_forbidden(self):
+        self.assertEqual(self.upload('stranger', self.manga.pk).status_code, 403)
+        self.assertFalse(IngestJob.objects.exists())
+
+    def test_owner_upload_is_queued(self):
+        response = self.upload('owner', self.manga.pk)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(IngestJob.objects.get().manga, self.manga)
+
+
+class IngestJobLeaseTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp_dir.name, CHAPTER_PAGE_WORKERS=1)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.manga = create_manga('Lease')
+        user = User.objects.create(username='uploader', email='uploader@example.com')
+        job = IngestJob(manga=self.manga, created_by=user, volume=1, chapter=1, chapter_title='Chapter')
+        job.archive.save('chapter.zip', ContentFile(chapter_archive(['red', 'green', 'blue'])))
+        self.archive_name = job.archive.name
+        self.addCleanup(job.archive.storage.delete, self.archive_name)
+        self.job = claim_next_job()
+
+    def steal_job(self):
+        # Другой воркер счёл задачу зависшей и забрал её себе
+        IngestJob.objects.filter(pk=self.job.pk).update(lease='other-worker')
+
+    def assert_untouched(self):
+        job = IngestJob.objects.get(pk=self.job.pk)
+        self.assertEqual(job.status, IngestJob.STATUS_RUNNING)
+        self.assertEqual(job.lease, 'other-worker')
+        self.assertTrue(job.archive.storage.exists(self.archive_name))
+        self.assertFalse(MangaPage.objects.filter(manga=self.manga).exists())
+
+    def test_finished_job_releases_archive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = run_job(self.job)
+        self.assertEqual(job.status, IngestJob.STATUS_DONE)
+        self.assertEqual(MangaPage.objects.filter(manga=self.manga).count(), 3)
+        self.assertFalse(job.archive.storage.exists(self.archive_name))
+
+    @override_settings(INGEST_HEARTBEAT_INTERVAL=0)
+    def test_lost_lease_stops_during_staging(self):
+        self.steal_job()
+        with self.captureOnCommitCallbacks(execute=True):
+            run_job(self.job)
+        self.assert_untouched()
+
+    @override_settings(INGEST_HEARTBEAT_INTERVAL=3600, INGEST_PROGRESS_INTERVAL=1000)
+    def test_lost_lease_is_checked_before_saving_pages(self):
+        # Heartbeat не успел заметить потерю задачи: её ловит проверка в транзакции записи
+        self.steal_job()
+        with self.captureOnCommitCallbacks(execute=True):
+            run_job(self.job)
+        self.assert_untouched()
+
+    def test_heartbeat_during_staging(self):
+        IngestJob.objects.filter(pk=self.job.pk).update(heartbeat_at=None)
+        with override_settings(INGEST_HEARTBEAT_INTERVAL=0), mock.patch('MangaLib.ingest.ChapterIngest.save_rows'):
+            run_job(self.job)
+        self.assertIsNotNone(IngestJob.objects.get(pk=self.job.pk).heartbeat_at)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.tmp_dir.name, INGEST_UPLOAD_ROOT=os.path.join(self.tmp_dir.name, 'ingest'),
+            CHUNKED_UPLOAD_CHUNK_SIZE=1024,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create(username='uploader', email='uploader@example.com')
+        self.archive = chapter_archive(['red', 'green', 'blue'])
+        self.session = open_session(create_manga('Chunks'), self.user, 1, 1, 'Chapter', len(self.archive))
+
+    def chunk(self, index):
+        return self.archive[index * 1024:(index + 1) * 1024]
+
+    def send(self, index, sha256=None):
+        data = self.chunk(index)
+        return write_chunk(self.session, index, io.BytesIO(data), sha256 or hashlib.sha256(data).hexdigest())
+
+    def test_chunks_in_any_order_assemble_the_archive(self):
+        self.assertGreater(self.session.chunk_count, 2)
+        for index in reversed(range(self.session.chunk_count)):
+            self.send(index)
+
+        job = finalize_session(self.session.id, hashlib.sha256(self.archive).hexdigest())
+        with ingest_upload_storage().open(job.archive.name) as archive:
+            self.assertEqual(archive.read(), self.archive)
+
+    def test_chunk_with_wrong_checksum_is_not_counted(self):
+        with self.assertRaises(ValidationError):
+            self.send(0, sha256='0' * 64)
+        self.assertEqual(missing_chunks(self.session), list(range(self.session.chunk_count)))
+        with open(session_path(self.session), 'rb') as f:
+            self.assertEqual(f.read(1024), bytes(1024))
+
+    def test_finalize_with_missing_chunk_keeps_session_open(self):
+        for index in range(1, self.session.chunk_count):
+            self.send(index)
+
+        with self.assertRaises(ValidationError):
+            finalize_session(self.session.id)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.status, UploadSession.STATUS_OPEN)
+        self.assertEqual(missing_chunks(self.session), [0])
+        self.assertFalse(IngestJob.objects.exists())
+
+    def test_repeated_finalize_returns_the_same_job(self):
+        for index in range(self.session.chunk_count):
+            self.send(index)
+
+        job = finalize_session(self.session.id)
+        self.assertEqual(finalize_session(self.session.id), job)
+        self.assertEqual(IngestJob.objects.count(), 1)
+        # После finalize куски больше не принимаются
+        with self.assertRaises(ValidationError):
+            self.send(0)
+
+    def test_abandoned_sessions_are_purged(self):
+        fresh = open_session(self.session.manga, self.user, 1, 2, 'Chapter', len(self.archive))
+        UploadSession.objects.filter(pk=self.session.pk).update(
+            updated_at=self.session.updated_at - datetime.timedelta(seconds=settings.CHUNKED_UPLOAD_SESSION_TTL + 1),
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(purge_abandoned_sessions(), 1)
+        self.assertEqual(list(UploadSession.objects.values_list('pk', flat=True)), [fresh.pk])
+        self.assertFalse(os.path.exists(session_path(self.session)))
+        self.assertTrue(os.path.exists(session_path(fresh)))
+
+
+class PageBlobTests(TestCase):
+    sha256 = 'ab' * 32
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.result = PageResult(width=40, height=60, file_size=10, sha256=self.sha256, format='JPEG', error=None)
+        self.name = blob_name(self.sha256, 'JPEG')
+        os.makedirs(os.path.dirname(blob_path(self.name)))
+        with open(blob_path(self.name), 'wb') as f:
+            f.write(b'page bytes')
+
+    def create_unreferenced_blob(self):
+        return PageBlob.objects.create(sha256=self.sha256, image=self.name, file_size=10, width=40, height=60)
+
+    def test_acquire_recreates_blob_collected_while_waiting(self):
+        self.create_unreferenced_blob()
+        select_for_update = PageBlob.objects.select_for_update
+        calls = []
+
+        def collected_before_lock(*args, **kwargs):
+            # Вставка упёрлась в существующую строку, а сборщик удалил её раньше, чем мы её заблокировали
+            if not calls:
+                PageBlob.objects.filter(sha256=self.sha256).delete()
+            calls.append(1)
+            return select_for_update(*args, **kwargs)
+
+        with mock.patch.object(PageBlob.objects, 'select_for_update', side_effect=collected_before_lock):
+            blobs = acquire_blobs([self.result, self.result])
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(PageBlob.objects.get(sha256=self.sha256).refcount, 2)
+        self.assertEqual(blobs[self.sha256].sha256, self.sha256)
+
+    def test_files_are_deleted_after_commit(self):
+        self.create_unreferenced_blob()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(collect_unreferenced_blobs(), 1)
+        self.assertFalse(PageBlob.objects.exists())
+        self.assertTrue(os.path.exists(blob_path(self.name)))
+
+        for callback in callbacks:
+            callback()
+        self.assertFalse(os.path.exists(blob_path(self.name)))
+        self.assertEqual(os.listdir(os.path.dirname(blob_path(self.name))), [])
+
+    def test_file_of_recreated_blob_is_kept(self):
+        self.create_unreferenced_blob()
+        with self.captureOnCommitCallbacks() as callbacks:
+            collect_unreferenced_blobs()
+        # Загрузка главы создала блоб заново до того, как сборщик дошёл до файлов
+        with self.captureOnCommitCallbacks(execute=True):
+            acquire_blobs([self.result])
+
+        for callback in callbacks:
+            callback()
+        with open(blob_path(self.name), 'rb') as f:
+            self.assertEqual(f.read(), b'page bytes')
+        self.assertEqual(os.listdir(os.path.dirname(blob_path(self.name))), [os.path.basename(self.name)])
+
+
+class ChapterReuploadTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp_dir.name, CHAPTER_PAGE_WORKERS=1)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.manga = create_manga('Reupload')
+
+    def ingest(self, chapter_title, pages):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_chapter_archive(self.manga, io.BytesIO(chapter_archive(pages)), 1, 1, chapter_title)
+
+    def chapter_rows(self):
+        return list(
+            MangaPage.objects.filter(manga=self.manga, volume=1, chapter=1)
+            .order_by('Chapter_Title', 'page_number').values_list('Chapter_Title', 'page_number')
+        )
+
+    def test_ingest_invalidates_cached_feeds(self):
+        cache.clear()
+        client = APIClient()
+
+        def feed_chapters():
+            cards = client.get('/api/new/').data['manga']
+            return [card['Chapters'] for card in cards if card['id'] == self.manga.pk]
+
+        self.assertEqual(feed_chapters(), [0])
+        self.ingest('A', ['red', 'green'])
+        self.assertEqual(feed_chapters(), [1])
+
+    def test_macos_archive_metadata_is_skipped(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for index, color in enumerate(['red', 'green'], start=1):
+                archive.writestr(f'chapter/{index:03d}.jpg', jpeg_bytes(color=color))
+                # AppleDouble-копии не являются изображениями
+                archive.writestr(f'__MACOSX/chapter/._{index:03d}.jpg', b'\x00\x05\x16\x07 AppleDouble')
+            archive.writestr('chapter/._003.jpg', b'\x00\x05\x16\x07 AppleDouble')
+            archive.writestr('chapter/.DS_Store', b'\x00\x00\x00\x01Bud1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_chapter_archive(self.manga, io.BytesIO(buffer.getvalue()), 1, 1, 'A')
+        self.assertEqual(self.chapter_rows(), [('A', 1), ('A', 2)])
+
+    def test_rows_under_another_title_do_not_collide(self):
+        self.ingest('A', ['red', 'green', 'blue'])
+        # Старые строки той же главы под другим названием, с теми же номерами страниц
+        for page_number in (1, 2):
+            MangaPage.objects.create(
+                manga=self.manga, volume=1, chapter=1, page_number=page_number,
+                Chapter_Title='B', page_image=f'legacy/{page_number}.jpg',
+            )
+
+        self.ingest('A', ['red', 'green', 'blue'])
+        self.assertEqual(self.chapter_rows(), [('A', 1), ('A', 2), ('A', 3)])
+
+    def test_reupload_under_new_title_reuses_rows(self):
+        self.ingest('A', ['red', 'green', 'blue'])
+        page_ids = set(MangaPage.objects.filter(manga=self.manga).values_list('id', flat=True))
+
+        self.ingest('C', ['red', 'white'])
+        self.assertEqual(self.chapter_rows(), [('C', 1), ('C', 2)])
+        self.assertTrue(set(MangaPage.objects.filter(manga=self.manga).values_list('id', flat=True)) <= page_ids)
+        self.assertEqual(
+            sorted(PageBlob.objects.values_list('refcount', flat=True)), [0, 0, 1, 1],
+        )
+
+
+class RatingTotalsMigrationTests(TestCase):
+    def test_totals_are_recomputed_from_reviews(self):
+        manga = create_manga()
+        empty = create_manga('Empty')
+        for index, rating in enumerate([8, 9, 6.5]):
+            user = User.objects.create(username=f'reader{index}', email=f'reader{index}@example.com')
+            Review.objects.bulk_create([Review(user=user, manga=manga, text='Review', rating=rating)])
+        # Значения, разошедшиеся с отзывами при старом неатомарном пересчёте
+        Manga.objects.filter(pk=manga.pk).update(RatingSum=0, RatingCount=5, Rating=9.9)
+        Manga.objects.filter(pk=empty.pk).update(RatingSum=3, RatingCount=1, Rating=3)
+
+        migration('0035_manga_ratingsum').fill_rating_totals(apps, None)
+
+        manga.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual((manga.RatingSum, manga.RatingCount, manga.Rating), (23.5, 3, 7.83))
+        self.assertEqual((empty.RatingSum, empty.RatingCount, empty.Rating), (0, 0, 0))
+
+
+class ReviewRatingTests(TestCase):
+    def setUp(self):
+        self.manga = create_manga('Rated')
+        self.client = APIClient()
+
+    def reader(self, username):
+        return User.objects.create(username=username, email=f'{username}@example.com')
+
+    def review(self, user, rating):
+        self.client.force_authenticate(user)
+        response = self.client.post(f'/api/manga/{self.manga.pk}/add_review/', {'text': 'Review', 'rating': rating})
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def assert_rating(self, histogram, rating_count, rating, score):
+        manga = Manga.objects.get(pk=self.manga.pk)
+        self.assertEqual(rating_histogram(self.manga.pk), histogram)
+        self.assertEqual((manga.RatingCount, manga.Rating, manga.Score), (rating_count, rating, score))
+
+    @override_settings(RATING_PRIOR_MEAN=7.0, RATING_PRIOR_WEIGHT=10)
+    def test_bucket_and_score_follow_create_change_and_delete(self):
+        reader = self.reader('reader')
+        self.review(reader, 8.5)
+        # 8.5 округляется вверх; Score = (10 * 7 + 8.5) / 11
+        self.assert_rating([0] * 9 + [1, 0], 1, 8.5, 7.1364)
+
+        self.review(reader, 4.4)
+        self.assert_rating([0] * 4 + [1] + [0] * 6, 1, 4.4, 6.7636)
+
+        self.review(self.reader('other'), 10)
+        self.assert_rating([0] * 4 + [1] + [0] * 5 + [1], 2, 7.2, 7.0333)
+
+        Review.objects.get(user=reader).delete()
+        self.assert_rating([0] * 10 + [1], 1, 10.0, 7.2727)
+        Review.objects.all().delete()
+        self.assert_rating([0] * 11, 0, 0.0, 0.0)
+
+    def test_deleted_review_invalidates_manga_and_feeds(self):
+        cache.clear()
+
+        def feed_rating():
+            cards = self.client.get('/api/new/').data['manga']
+            return [card['Rating'] for card in cards if card['id'] == self.manga.pk]
+
+        self.review(self.reader('first'), 8)
+        leaving = self.reader('second')
+        self.review(leaving, 6)
+        self.assertEqual(feed_rating(), [7.0])
+        version = Manga.objects.get(pk=self.manga.pk).version
+
+        # Отзыв удаляется каскадом вместе с пользователем, мимо AddOrUpdateReviewView
+        leaving.delete()
+        self.assertEqual(Manga.objects.get(pk=self.manga.pk).version, version + 1)
+        self.assertEqual(feed_rating(), [8.0])
+
+
+class BookmarkTests(TestCase):
+    def setUp(self):
+        self.first = create_manga('First')
+        self.second = create_manga('Second')
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+
+    def counts(self):
+        return list(Manga.objects.filter(pk__in=[self.first.pk, self.second.pk]).order_by('pk')
+                    .values_list('bookmark_count', flat=True))
+
+    def bookmarked(self, user=None):
+        return sorted((user or self.user).bookmarks.values_list('pk', flat=True))
+
+    def test_double_toggle_restores_state(self):
+        self.assertTrue(toggle_bookmark(self.user, self.first.pk))
+        self.assertEqual(self.counts(), [1, 0])
+        self.assertFalse(toggle_bookmark(self.user, self.first.pk))
+        self.assertEqual(self.counts(), [0, 0])
+        self.assertEqual(self.bookmarked(), [])
+
+    def test_toggle_undoes_bookmark_added_through_m2m(self):
+        # Закладка через менеджер m2m считается сигналом, снятие — напрямую по таблице связей
+        self.user.bookmarks.add(self.first)
+        self.assertEqual(self.counts(), [1, 0])
+        self.assertFalse(toggle_bookmark(self.user, self.first.pk))
+        self.assertEqual(self.counts(), [0, 0])
+
+    def test_batch_changes_are_symmetric(self):
+        other = User.objects.create(username='other', email='other@example.com')
+        missing_id = self.second.pk + 100
+        self.assertEqual(change_bookmarks(self.user, add_ids=[self.first.pk, self.second.pk, missing_id]),
+                         ([self.first.pk, self.second.pk], []))
+        change_bookmarks(other, add_ids=[self.first.pk])
+        self.assertEqual(self.counts(), [2, 1])
+
+        # Повтор уже выполненных изменений ничего не меняет
+        self.assertEqual(change_bookmarks(self.user, add_ids=[self.first.pk]), ([], []))
+        self.assertEqual(change_bookmarks(other, remove_ids=[self.second.pk]), ([], []))
+        self.assertEqual(self.counts(), [2, 1])
+
+        self.assertEqual(change_bookmarks(self.user, add_ids=[self.first.pk], remove_ids=[self.second.pk]),
+                         ([], [self.second.pk]))
+        self.assertEqual(change_bookmarks(self.user, remove_ids=[self.first.pk, self.second.pk]),
+                         ([], [self.first.pk]))
+        change_bookmarks(other, remove_ids=[self.first.pk])
+        self.assertEqual(self.counts(), [0, 0])
+        self.assertEqual((self.bookmarked(), self.bookmarked(other)), ([], []))
+
+
+class MyMangaStateTests(TestCase):
+    def setUp(self):
+        self.manga = [create_manga(f'State {index}') for index in range(4)]
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.user.bookmarks.add(self.manga[0], self.manga[1])
+        self.user.favourite.add(self.manga[1])
+        Review.objects.create(user=self.user, manga=self.manga[2], text='Review', rating=9)
+        # Чужие закладки и отзывы в ответ не попадают
+        other = User.objects.create(username='other', email='other@example.com')
+        other.bookmarks.add(self.manga[3])
+        Review.objects.create(user=other, manga=self.manga[3], text='Review', rating=3)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def state(self, ids):
+        return self.client.get('/api/me/state/', {'ids': ','.join(str(manga_id) for manga_id in ids)})
+
+    def test_state_of_a_page_takes_three_queries(self):
+        ids = [manga.pk for manga in self.manga]
+        with self.assertNumQueries(3):
+            response = self.state(ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'bookmarked': ids[:2], 'favourited': [ids[1]], 'ratings': {str(ids[2]): 9.0},
+        })
+
+    def test_response_is_private(self):
+        response = self.state([self.manga[0].pk])
+        cache_control = {directive.strip() for directive in response['Cache-Control'].split(',')}
+        self.assertTrue({'private', 'no-cache'} <= cache_control)
+        self.assertNotIn('public', cache_control)
+
+    def test_too_many_ids_are_rejected(self):
+        self.assertEqual(self.state(range(1, settings.ME_STATE_MAX_IDS + 2)).status_code, 400)
+
+
+class MangaReviewsCursorTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.manga = create_manga('Reviewed')
+        self.created_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        for index in range(5):
+            self.add_review(f'reader{index}')
+        # Две пары отзывов с одинаковым временем: порядок внутри пары решает id
+        Review.objects.filter(user__username__in=['reader1', 'reader2']).update(created_at=self.created_at)
+        Review.objects.filter(user__username__in=['reader3', 'reader4']).update(
+            created_at=self.created_at + datetime.timedelta(days=1),
+        )
+
+    def add_review(self, username):
+        user = User.objects.create(username=username, email=f'{username}@example.com')
+        return Review.objects.create(user=user, manga=self.manga, text='Review', rating=7)
+
+    def page(self, cursor=None, sort=None):
+        params = {'page_size': 2}
+        if cursor is not None:
+            params['cursor'] = cursor
+        if sort is not None:
+            params['sort'] = sort
+        response = self.client.get(f'/api/manga/{self.manga.pk}/reviews/', params)
+        self.assertEqual(response.status_code, 200)
+        return [review['user'] for review in response.data['results']], response.data['next']
+
+    def reviewers(self, sort=None, inserted_after_first_page=None):
+        names, cursor = self.page(sort=sort)
+        if inserted_after_first_page is not None:
+            self.add_review(inserted_after_first_page)
+        while cursor is not None:
+            page, cursor = self.page(cursor, sort)
+            names += page
+        return names
+
+    def test_pages_are_stable_with_equal_timestamps(self):
+        self.assertEqual(self.reviewers('oldest'), ['reader1', 'reader2', 'reader3', 'reader4', 'reader0'])
+        # Новый отзыв между запросами страниц не сдвигает уже выданные и не дублирует их
+        self.assertEqual(
+            self.reviewers(inserted_after_first_page='late'), ['reader0', 'reader4', 'reader3', 'reader2', 'reader1'],
+        )
+
+    def test_page_is_one_query(self):
+        _, cursor = self.page()
+        with self.assertNumQueries(1):
+            self.page(cursor)
+
+
+class SuggestIndexRefreshTests(TestCase):
+    def titles(self, index, query):
+        return [entry['title'] for entry in index.search(query, 10)]
+
+    def test_expired_index_is_served_while_rebuilt_in_background(self):
+        manga = create_manga('One Piece')
+        index = SuggestIndex()
+        self.assertEqual(self.titles(index, 'piece'), ['One Piece'])
+
+        create_manga('Piece of Cake')
+        index._built_at -= settings.SUGGEST_INDEX_TTL + 1
+        with mock.patch('MangaLib.suggest.threading.Thread') as thread:
+            # Запрос не ждёт пересборки и получает старый индекс; поток запускается один раз
+            self.assertEqual(self.titles(index, 'piece'), ['One Piece'])
+            self.assertEqual(self.titles(index, 'piece'), ['One Piece'])
+        self.assertEqual(thread.call_count, 1)
+        thread.return_value.start.assert_called_once_with()
+
+        # Пока идёт пересборка, приходит сигнал об изменении, которого выборка не увидит
+        manga.Title = 'One Piece Film'
+        index.update_manga(manga)
+        refresh = thread.call_args.kwargs['target']
+        with mock.patch('MangaLib.suggest.connections'):
+            refresh()
+
+        self.assertEqual(self.titles(index, 'piece'), ['One Piece Film', 'Piece of Cake'])
+        self.assertFalse(index._refreshing)
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import IngestJob, UploadChunk, UploadSession, ingest_upload_storage
+from .pages import file_sha256
+
+
+def session_path(session):
+    return ingest_upload_storage().path(session.file_name)
+
+
+def open_session(manga, user, volume, chapter, chapter_title, total_size):
+    if total_size <= 0:
+        raise serializers.ValidationError({'total_size': "Размер архива должен быть больше нуля."})
+    if total_size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        raise serializers.ValidationError({'total_size': "Архив слишком большой."})
+
+    session = UploadSession.objects.create(
+        manga=manga, created_by=user, volume=volume, chapter=chapter, chapter_title=chapter_title,
+        total_size=total_size, chunk_size=settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+    )
+    # Файл сразу нужного размера (разреженный): куски можно присылать в любом порядке и параллельно
+    path = session_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(total_size)
+    return session
+
+
+def write_chunk(session, index, stream, expected_sha256):
+    if session.status != UploadSession.STATUS_OPEN:
+        raise serializers.ValidationError("Загрузка уже завершена.")
+    if not 0 <= index < session.chunk_count:
+        raise serializers.ValidationError("Неверный номер куска.")
+    expected_sha256 = (expected_sha256 or '').strip().lower()
+    if len(expected_sha256) != 64:
+        raise serializers.ValidationError("Не передана контрольная сумма куска (X-Chunk-SHA256).")
+
+    # Тело запроса принимаем во временный файл без блокировки, чтобы куски одной сессии шли параллельно
+    length = session.chunk_length(index)
+    sha256 = hashlib.sha256()
+    received = 0
+    with tempfile.TemporaryFile(dir=os.path.dirname(session_path(session))) as chunk:
+        while stream is not None:
+            data = stream.read(settings.CHAPTER_INGEST_BUFFER_SIZE)
+            if not data:
+                break
+            received += len(data)
+            if received > length:
+                raise serializers.ValidationError("Кусок больше ожидаемого размера.")
+            sha256.update(data)
+            chunk.write(data)
+
+        if received != length:
+            raise serializers.ValidationError(f"Ожидалось {length} байт, получено {received}.")
+        # Несовпавший кусок не засчитывается, файл сессии он не трогает
+        if sha256.hexdigest() != expected_sha256:
+            raise serializers.ValidationError("Контрольная сумма куска не совпадает.")
+
+        chunk.seek(0)
+        with transaction.atomic():
+            # Под блокировкой строки: finalize и удаление сессии ждут, пока кусок не будет записан
+            session = UploadSession.objects.select_for_update().filter(pk=session.pk).first()
+            if session is None or session.status != UploadSession.STATUS_OPEN:
+                raise serializers.ValidationError("Загрузка уже завершена.")
+            with open(session_path(session), 'r+b') as f:
+                f.seek(index * session.chunk_size)
+                shutil.copyfileobj(chunk, f, settings.CHAPTER_INGEST_BUFFER_SIZE)
+            UploadChunk.objects.update_or_create(
+                session=session, index=index, defaults={'size': length, 'sha256': expected_sha256},
+            )
+            session.save(update_fields=['updated_at'])
+    return length
+
+
+def received_ranges(session):
+    # Полученные байты в виде полуоткрытых диапазонов [start, end), соседние куски склеиваются
+    ranges = []
+    for index in session.chunks.order_by('index').values_list('index', flat=True):
+        start = index * session.chunk_size
+        end = start + session.chunk_length(index)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def missing_chunks(session):
+    received = set(session.chunks.values_list('index', flat=True))
+    return [index for index in range(session.chunk_count) if index not in received]
+
+
+def finalize_session(session_id, expected_sha256=None):
+    # Повторный finalize возвращает уже созданную задачу, второй раз архив в очередь не попадёт
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update(of=('self',)).select_related('job').get(pk=session_id)
+        if session.status == UploadSession.STATUS_FINALIZED:
+            return session.job
+
+        missing = missing_chunks(session)
+        if missing:
+            # Список недостающих кусков отдаёт GET сессии
+            raise serializers.ValidationError(f"Получены не все куски, не хватает {len(missing)}.")
+
+        path = session_path(session)
+        if expected_sha256 and file_sha256(path) != expected_sha256.strip().lower():
+            raise serializers.ValidationError("Контрольная сумма архива не совпадает.")
+        if not zipfile.is_zipfile(path):
+            raise serializers.ValidationError("Файл не является ZIP-архивом.")
+
+        # Собранный файл уже лежит в хранилище очереди: переносим его без копирования
+        storage = ingest_upload_storage()
+        archive_name = f'{timezone.now():%Y/%m/%d}/session-{session.pk}.zip'
+        os.makedirs(os.path.dirname(storage.path(archive_name)), exist_ok=True)
+        os.replace(path, storage.path(archive_name))
+        try:
+            job = IngestJob.objects.create(
+                manga_id=session.manga_id,
+                created_by_id=session.created_by_id,
+                archive=archive_name,
+                volume=session.volume,
+                chapter=session.chapter,
+                chapter_title=session.chapter_title,
+            )
+            session.status = UploadSession.STATUS_FINALIZED
+            session.job = job
+            session.save(update_fields=['status', 'job', 'updated_at'])
+            session.chunks.all().delete()
+        except BaseException:
+            # Сессия остаётся открытой, возвращаем файл на место для повторного finalize
+            os.replace(storage.path(archive_name), path)
+            raise
+    return job
+
+
+def discard_session(session_id, idle_since=None):
+    # Удаляет открытую сессию; с idle_since — только если в неё с тех пор ничего не писали
+    with transaction.atomic():
+        sessions = UploadSession.objects.select_for_update().filter(pk=session_id, status=UploadSession.STATUS_OPEN)
+        if idle_since is not None:
+            sessions = sessions.filter(updated_at__lt=idle_since)
+        session = sessions.first()
+        if session is None:
+            return False
+        path = session_path(session)
+        session.delete()
+        transaction.on_commit(lambda: remove_session_file(path))
+    return True
+
+
+def remove_session_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def purge_abandoned_sessions():
+    # Брошенные клиентами сессии: ни одного куска дольше CHUNKED_UPLOAD_SESSION_TTL
+    idle_since = timezone.now() - timedelta(seconds=settings.CHUNKED_UPLOAD_SESSION_TTL)
+    session_ids = UploadSession.objects.filter(
+        status=UploadSession.STATUS_OPEN, updated_at__lt=idle_since,
+    ).values_list('pk', flat=True)
+    return sum(discard_session(session_id, idle_since) for session_id in list(session_ids))
@@ -1,22 +1,44 @@
+import base64
+import binascii
+import json
 import os
 from datetime import datetime, timedelta
 from itertools import groupby
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.db.models import Q, Count
-from django.http import Http404, HttpResponse, FileResponse
+from django.http import Http404
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from rest_framework import generics, status, views
+from rest_framework.exceptions import NotFound
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.generics import get_object_or_404, ListAPIView, CreateAPIView
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import User, Manga, Review, News, Category, Person, MangaPage
+from .bookmarks import change_bookmarks, toggle_bookmark
+from .cache import cached_feed, bump_catalog_version, feed_cache_stats
+from .images import generate_variants, serve_image
+from .media import serve_media
+from .ratings import record_review_change, rating_histogram
+from .models import User, Manga, Review, News, Category, Person, MangaPage, IngestJob, UploadSession
+from .search import SEARCH_FIELDS, search_manga
+from .suggest import suggest_index
+from .uploads import open_session, write_chunk, received_ranges, missing_chunks, finalize_session, \
+    discard_session
 from .serializers import UserSerializer, MangaSerializer, ReviewSerializer, MangaZipSerializer, NewsSerializer, \
-    CategorySerializer, PersonSerializer, MangaVolumeSerializer, MangaModerationSerializer
+    CategorySerializer, PersonSerializer, MangaVolumeSerializer, MangaModerationSerializer, MangaCardSerializer, \
+    IngestJobSerializer, UploadSessionSerializer, BookmarkBatchSerializer, MangaIdsSerializer
 from django.shortcuts import render
 
 
@@ -32,6 +54,124 @@ class CatalogPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class CatalogCursorPagination(BasePagination):
+    # Keyset-пагинация: страница выбирается условием по (поле сортировки, id),
+    # а не OFFSET, поэтому глубокие страницы стоят столько же, сколько первая
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None, ordering='-id'):
+        self.field = ordering.lstrip('-')
+        self.descending = ordering.startswith('-')
+        page_size = self.get_page_size(request)
+
+        prefix = '-' if self.descending else ''
+        if self.field == 'id':
+            queryset = queryset.order_by(f'{prefix}id')
+        else:
+            # id как стабильный тайбрейкер для одинаковых значений
+            queryset = queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            value, pk = cursor
+            lookup = 'lt' if self.descending else 'gt'
+            if self.field == 'id':
+                queryset = queryset.filter(**{f'id__{lookup}': pk})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{self.field}__{lookup}': value}) |
+                    Q(**{self.field: value, f'id__{lookup}': pk})
+                )
+
+        # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next_cursor,
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        page_size = request.query_params.get(self.page_size_query_param)
+        if page_size is None and isinstance(request.data, dict):
+            page_size = request.data.get(self.page_size_query_param)
+        try:
+            page_size = int(page_size)
+        except (TypeError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request, model):
+        # Курсор принимаем как из query-параметров (GET), так и из тела запроса (POST)
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None and isinstance(request.data, dict):
+            encoded = request.data.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        if not isinstance(encoded, str):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError, UnicodeEncodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        # Курсор приходит от клиента: проверяем форму [значение, id] и тип значения
+        # до того, как он попадёт в фильтр запроса
+        if not isinstance(payload, list) or len(payload) != 2:
+            raise NotFound(self.invalid_cursor_message)
+        value, pk = payload
+        if not isinstance(pk, int) or isinstance(pk, bool):
+            raise NotFound(self.invalid_cursor_message)
+        if self.field == 'id':
+            return None, pk
+        if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            value = model._meta.get_field(self.field).to_python(value)
+        except (DjangoValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def encode_cursor(self, instance):
+        value = getattr(instance, self.field)
+        if hasattr(value, 'isoformat'):
+            # isoformat сохраняет микросекунды, в отличие от DjangoJSONEncoder
+            value = value.isoformat()
+        payload = json.dumps([value, instance.pk], ensure_ascii=False)
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+CATALOG_SORT_ORDERING = {
+    'popularity': '-bookmark_count',
+    'rating': '-Rating',
+    'chapters': '-Chapters',
+    'release_date': '-Release',
+    'update_date': '-Created_at',
+    'add_date': '-id',
+    'title_az': 'Title',
+    'title_za': '-Title',
+}
+
+
+REVIEW_SORT_ORDERING = {
+    'newest': '-created_at',
+    'oldest': 'created_at',
+}
+
+
 class UserPagination(PageNumberPagination):
     page_size = 4
     page_size_query_param = 'page_size'
@@ -50,6 +190,33 @@ class NewsPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    # Для эндпоинтов, отдающих файлы: Accept выбирает формат изображения, а не рендерер DRF
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def manga_not_modified(request, manga):
+    # Отвечаем 304 до запуска сериализатора, если у клиента актуальная версия тайтла
+    response = get_conditional_response(
+        request, etag=manga.etag, last_modified=int(manga.Updated_at.timestamp())
+    )
+    if response is not None:
+        set_manga_validators(response, manga)
+    return response
+
+
+def set_manga_validators(response, manga):
+    response['ETag'] = manga.etag
+    response['Last-Modified'] = http_date(manga.Updated_at.timestamp())
+    # Клиент может хранить ответ, но обязан перепроверять его по ETag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
 class DeleteUserView(APIView):#удаление юзера
     permission_classes = [IsAuthenticated]
     def delete(self, request):
@@ -60,6 +227,7 @@ class DeleteUserView(APIView):#удаление юзера
 
 class MangaPageDetailView(APIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
+    content_negotiation_class = IgnoreClientContentNegotiation
 
     def get(self, request, manga_id):
         # Извлечение параметров из query parameters
@@ -87,15 +255,59 @@ class MangaPageDetailView(APIView):
         if not image:
             return Response({"detail": "Image not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Возвращаем файл изображения как ответ
-        return FileResponse(image)
+        # Возвращаем файл изображения (или его уменьшенную копию по ?w=)
+        return serve_image(request, image.name)
+
+
+class ChapterManifestView(APIView):
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get(self, request, manga_id, volume, chapter_title):
+        manga = get_object_or_404(Manga.objects.only('id', 'version', 'Updated_at'), id=manga_id)
+        # Версия манги растёт при загрузке глав, поэтому годится и как ETag манифеста
+        not_modified = manga_not_modified(request, manga)
+        if not_modified is not None:
+            return not_modified
+
+        # Все страницы главы одним запросом; читалка дальше грузит картинки напрямую с медиа-сервера
+        pages = (
+            MangaPage.objects
+            .filter(manga_id=manga_id, volume=volume, Chapter_Title=chapter_title)
+            .order_by('page_number')
+            .values_list('page_number', 'page_image', 'width', 'height', 'file_size')
+        )
+        page_list = [
+            {
+                'page_number': page_number,
+                'url': default_storage.url(page_image),
+                'width': width,
+                'height': height,
+                'size': file_size,
+            }
+            for page_number, page_image, width, height, file_size in pages
+        ]
+        if not page_list:
+            return Response({"detail": "Chapter not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        response_data = {
+            'manga_id': manga.id,
+            'volume': volume,
+            'chapter_title': chapter_title,
+            'page_count': len(page_list),
+            'pages': page_list,
+        }
+        return set_manga_validators(Response(response_data, status=status.HTTP_200_OK), manga)
 
 
 class MangaVolumesAndChaptersView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, manga_id):
-        manga = get_object_or_404(Manga, id=manga_id)
+        manga = get_object_or_404(Manga.objects.only('id', 'Title', 'version', 'Updated_at'), id=manga_id)
+        not_modified = manga_not_modified(request, manga)
+        if not_modified is not None:
+            return not_modified
+
         # Получаем тома и главы манги
         volumes_and_chapters = (
             MangaPage.objects
@@ -136,7 +348,7 @@ class MangaVolumesAndChaptersView(APIView):
                 'manga_title': result['manga_title'],
                 'volumes': serializer.data
             }
-            return Response(response_data, status=status.HTTP_200_OK)
+            return set_manga_validators(Response(response_data, status=status.HTTP_200_OK), manga)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -179,7 +391,7 @@ class UsernameBookmarksView(APIView):
 
 class CatalogListView(APIView):
     permission_classes = [AllowAny]
-    pagination_class = CatalogPagination
+    pagination_class = CatalogCursorPagination
     def post(self, request):
         sort_by = request.data.get('sort_by', 'popularity')  # По умолчанию сортировка по популярности
         status_filter = request.data.get('status', [])  # По умолчанию фильтр по статусу пустой список
@@ -197,26 +409,14 @@ class CatalogListView(APIView):
             queryset = queryset.filter(Category__name__in=category_filter).distinct()
 
         # Сортировка
-        if sort_by == 'popularity':
-            queryset = queryset.annotate(popularity=Count('bookmarked_users')).order_by('-popularity')
-        elif sort_by == 'rating':
-            queryset = queryset.order_by('-Rating')
-        elif sort_by == 'chapters':
-            queryset = queryset.order_by('-Chapters')
-        elif sort_by == 'release_date':
-            queryset = queryset.order_by('-Release')
-        elif sort_by == 'update_date':
-            queryset = queryset.order_by('-Created_at')
-        elif sort_by == 'add_date':
-            queryset = queryset.order_by('-id')
-        elif sort_by == 'title_az':
-            queryset = queryset.order_by('Title')
-        elif sort_by == 'title_za':
-            queryset = queryset.order_by('-Title')
+        ordering = CATALOG_SORT_ORDERING.get(sort_by, '-id')
 
-        serializer = MangaSerializer(queryset, many=True)
+        queryset = MangaCardSerializer.prepare_queryset(queryset)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request, view=self, ordering=ordering)
+        serializer = MangaCardSerializer(page, many=True)
 
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class StatusListView(APIView):
@@ -278,24 +478,114 @@ class NewsListView(APIView):
 class MangaUploadView(views.APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request, manga_id):
-        manga = Manga.objects.get(id=manga_id)
-        username = request.user.username
-        mangausername = manga.Created_by
-        print(mangausername)
-        if username != mangausername:
-            return Response({'error': 'You are not allowed to upload'},status.HTTP_401_UNAUTHORIZED)
         try:
             manga = Manga.objects.get(id=manga_id)
         except Manga.DoesNotExist:
             return Response({'error': 'Manga not found'}, status=status.HTTP_404_NOT_FOUND)
+        if request.user.username != manga.Created_by:
+            return Response({'error': 'You are not allowed to upload'}, status.HTTP_403_FORBIDDEN)
 
         serializer = MangaZipSerializer(data=request.data, context={'manga_id': manga_id})
         if serializer.is_valid():
-            manga = serializer.save()
-            return Response({'message': 'Manga uploaded successfully'}, status=status.HTTP_201_CREATED)
+            # Распаковка идёт в фоне (manage.py run_ingest_worker), запрос только ставит задачу в очередь
+            data = serializer.validated_data
+            job = IngestJob.objects.create(
+                manga=manga,
+                created_by=request.user,
+                archive=data['zip_file'],
+                volume=data['volume'],
+                chapter=data['chapter'],
+                chapter_title=data['chapter_title'],
+            )
+            return Response({
+                'message': 'Upload queued',
+                'job_id': job.id,
+                'status_url': reverse('ingest-job-status', args=[job.id]),
+            }, status=status.HTTP_202_ACCEPTED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class IngestJobStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = IngestJob.objects.select_related('manga').get(id=job_id)
+        except IngestJob.DoesNotExist:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        if job.created_by_id != request.user.id and not request.user.is_staff:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(IngestJobSerializer(job).data)
+
+
+class UploadSessionCreateView(APIView):
+    # Докачиваемая загрузка: сессия -> PUT кусков -> finalize (см. MangaLib/uploads.py)
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, manga_id):
+        try:
+            manga = Manga.objects.get(id=manga_id)
+        except Manga.DoesNotExist:
+            return Response({'error': 'Manga not found'}, status=status.HTTP_404_NOT_FOUND)
+        if request.user.username != manga.Created_by:
+            return Response({'error': 'You are not allowed to upload'}, status.HTTP_403_FORBIDDEN)
+
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        session = open_session(manga, request.user, data['volume'], data['chapter'], data['chapter_title'],
+                               data['total_size'])
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+
+def get_upload_session(request, session_id):
+    try:
+        return UploadSession.objects.select_related('job').get(id=session_id, created_by=request.user)
+    except UploadSession.DoesNotExist:
+        raise NotFound('Upload session not found')
+
+
+class UploadSessionView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        # Клиент после обрыва узнаёт, какие куски досылать
+        session = get_upload_session(request, session_id)
+        data = UploadSessionSerializer(session).data
+        data['received_ranges'] = received_ranges(session)
+        data['missing_chunks'] = missing_chunks(session)
+        return Response(data)
+
+    def delete(self, request, session_id):
+        session = get_upload_session(request, session_id)
+        if not discard_session(session.id):
+            return Response({'error': 'Upload is already finalized'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, session_id, index):
+        # Тело запроса — сырые байты куска, SHA-256 в заголовке X-Chunk-SHA256
+        session = get_upload_session(request, session_id)
+        size = write_chunk(session, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+        return Response({'index': index, 'size': size})
+
+
+class UploadSessionFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, session_id):
+        session = get_upload_session(request, session_id)
+        job = finalize_session(session.id, request.data.get('sha256'))
+        return Response({
+            'message': 'Upload queued',
+            'job_id': job.id,
+            'status_url': reverse('ingest-job-status', args=[job.id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
 class MangaIdView(APIView):
     permission_classes = [AllowAny]
     authentication_classes = [JWTAuthentication]
@@ -314,7 +604,7 @@ class MangaIdView(APIView):
         manga_serializer = MangaSerializer(manga)
 
         # Ищем отзыв текущего пользователя, если пользователь аутентифицирован
-        user_review = None
+        user_review_serializer = None
         is_in_bookmarks = False
         if request.user.is_authenticated:
             try:
@@ -323,8 +613,8 @@ class MangaIdView(APIView):
             except Review.DoesNotExist:
                 user_review_serializer = None
 
-            # Проверяем, есть ли тайтл в закладках пользователя
-            is_in_bookmarks = manga in request.user.bookmarks.all()
+            # Проверяем, есть ли тайтл в закладках пользователя (одна строка таблицы связей)
+            is_in_bookmarks = request.user.bookmarks.filter(pk=manga.pk).exists()
 
         # Подготавливаем ответ
         response_data = {
@@ -336,19 +626,49 @@ class MangaIdView(APIView):
         return Response(response_data, status=status.HTTP_200_OK)
 
 
+class MyMangaStateView(APIView):
+    # Состояние пользователя сразу для страницы карточек: закладки, избранное и его оценки.
+    # Три запроса по уникальным индексам (user, manga) вместо MangaIdView на каждую карточку
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = MangaIdsSerializer(data={'ids': request.query_params.get('ids', '').split(',')})
+        serializer.is_valid(raise_exception=True)
+        manga_ids = set(serializer.validated_data['ids'])
+        user = request.user
+
+        bookmarked = user.bookmarks.through.objects.filter(user_id=user.pk, manga_id__in=manga_ids)
+        favourited = user.favourite.through.objects.filter(user_id=user.pk, manga_id__in=manga_ids)
+        ratings = Review.objects.filter(user_id=user.pk, manga_id__in=manga_ids)
+
+        response = Response({
+            'bookmarked': sorted(bookmarked.values_list('manga_id', flat=True)),
+            'favourited': sorted(favourited.values_list('manga_id', flat=True)),
+            'ratings': dict(ratings.values_list('manga_id', 'rating')),
+        }, status=status.HTTP_200_OK)
+        # Ответ зависит от пользователя: общим кешам его хранить нельзя
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
 class MangaListView(APIView):
-    pagination_class = CatalogPagination
+    pagination_class = CatalogCursorPagination
     permission_classes = [AllowAny]
 
     def get(self, request, *args, **kwargs):
         mangas = Manga.objects.filter(Moderation_status='approved')  # Показываем только одобренные манги
-        serializer = MangaSerializer(mangas, many=True)
-        return Response(serializer.data)
+        ordering = CATALOG_SORT_ORDERING.get(request.query_params.get('sort_by'), '-id')
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(mangas, request, view=self, ordering=ordering)
+        serializer = MangaSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class Userimg(APIView):
     # Разрешаем доступ всем пользователям
     permission_classes = [AllowAny]
+    content_negotiation_class = IgnoreClientContentNegotiation
 
     def get(self, request, username=None, *args, **kwargs):
         # Ищем пользователя по username
@@ -360,12 +680,8 @@ class Userimg(APIView):
         if not profile_image:
             raise Http404("User does not have a profile image.")
 
-        # Открываем файл изображения и возвращаем его в ответе
-        try:
-            with open(profile_image.path, 'rb') as image_file:
-                return HttpResponse(image_file.read(), content_type="image/jpeg")
-        except FileNotFoundError:
-            raise Http404("Image file not found.")
+        # Отдаём файл потоком или через фронтовой сервер, не читая его в память
+        return serve_media(request, profile_image.name)
 
 
 class ProfileView(APIView):
@@ -424,12 +740,17 @@ class ApproveMangaView(APIView):
             if action == 'approve':
                 manga.Moderation_status = 'approved'
                 manga.Moderation_date = timezone.now()  # Устанавливаем дату успешной модерации
-                manga.save()
+                # Только поля модерации: полное сохранение затёрло бы счётчики, обновляемые через F()
+                manga.save(update_fields=['Moderation_status', 'Moderation_date'])
+                bump_catalog_version()
+                manga.bump_version()
                 return Response({"status": "Manga approved"}, status=status.HTTP_200_OK)
             elif action == 'reject':
                 manga.Moderation_status = 'rejected'
                 manga.Moderation_date = None  # Сбрасываем дату, если модерация не успешна
-                manga.save()
+                manga.save(update_fields=['Moderation_status', 'Moderation_date'])
+                bump_catalog_version()
+                manga.bump_version()
                 return Response({"status": "Manga rejected"}, status=status.HTTP_200_OK)
             else:
                 return Response({"error": "Invalid action"}, status=status.HTTP_400_BAD_REQUEST)
@@ -492,8 +813,12 @@ class MangaDetailView(APIView): # GET конкретный тайтл
 
     def get(self, request, pk, format=None):
         manga = get_object_or_404(Manga, pk=pk)
+        not_modified = manga_not_modified(request, manga)
+        if not_modified is not None:
+            return not_modified
+
         serializer = MangaSerializer(manga)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return set_manga_validators(Response(serializer.data, status=status.HTTP_200_OK), manga)
 
 
 class MangaUpdateView(APIView):
@@ -513,7 +838,9 @@ class MangaUpdateView(APIView):
         serializer = MangaSerializer(manga, data=request.data, partial=True)
 
         if serializer.is_valid():
-            serializer.save()
+            manga = serializer.save()
+            bump_catalog_version()
+            manga.bump_version()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -527,21 +854,29 @@ class AddBookmarkView(APIView):
         manga_id = request.data.get('manga_id')
 
         try:
-            manga = Manga.objects.get(id=manga_id)
-        except Manga.DoesNotExist:
+            manga_exists = Manga.objects.filter(id=manga_id).exists()
+        except (TypeError, ValueError):
+            manga_exists = False
+        if not manga_exists:
             return Response({"error": "Manga not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Проверяем, находится ли манга уже в закладках пользователя
-        if manga in user.bookmarks.all():
-            # Если манга уже в закладках, удаляем её
-            user.bookmarks.remove(manga)
-            user.save()
-            return Response({"status": "Manga removed from bookmarks"}, status=status.HTTP_200_OK)
-        else:
-            # Если манги нет в закладках, добавляем её
-            user.bookmarks.add(manga)
-            user.save()
+        # Одна проверка по таблице связей и одна вставка или удаление, без загрузки всех закладок
+        if toggle_bookmark(user, manga_id):
             return Response({"status": "Manga added to bookmarks"}, status=status.HTTP_200_OK)
+        return Response({"status": "Manga removed from bookmarks"}, status=status.HTTP_200_OK)
+
+
+class BookmarkBatchView(APIView):
+    # Пакетная синхронизация закладок для импорта и клиентов с офлайн-режимом
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BookmarkBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added, removed = change_bookmarks(
+            request.user, serializer.validated_data['add'], serializer.validated_data['remove'],
+        )
+        return Response({'added': added, 'removed': removed}, status=status.HTTP_200_OK)
 
 
 class AddFavouriteView(APIView):# POST добавить в избранное
@@ -565,45 +900,65 @@ class AddOrUpdateReviewView(generics.CreateAPIView):
     serializer_class = ReviewSerializer
 
     def perform_create(self, serializer):
-        manga_id = self.kwargs['manga_id']
-        manga = Manga.objects.get(id=manga_id)
-
-        # Попытка найти существующий отзыв
-        try:
-            review = Review.objects.get(user=self.request.user, manga=manga)
-            # Обновляем существующий отзыв
-            review.text = serializer.validated_data['text']
-            review.rating = serializer.validated_data['rating']
-            review.save()
-        except Review.DoesNotExist:
-            # Создаем новый отзыв
-            review = Review.objects.create(
-                user=self.request.user,
-                manga=manga,
-                text=serializer.validated_data['text'],
-                rating=serializer.validated_data['rating']
-            )
-            # Увеличиваем счетчик отзывов
-            manga.RatingCount += 1
+        manga = get_object_or_404(Manga.objects.only('id'), id=self.kwargs['manga_id'])
+        text = serializer.validated_data['text']
+        rating = serializer.validated_data['rating']
+
+        with transaction.atomic():
+            # Блокируем отзыв пользователя, чтобы два параллельных редактирования не посчитали разницу дважды
+            review = Review.objects.select_for_update().filter(user=self.request.user, manga=manga).first()
+            if review is not None:
+                # Обновляем существующий отзыв: к сумме добавляется только разница оценок
+                old_rating = review.rating
+                review.text = text
+                review.rating = rating
+                review.save(update_fields=['text', 'rating'])
+            else:
+                # Создаем новый отзыв
+                review = Review.objects.create(user=self.request.user, manga=manga, text=text, rating=rating)
+                old_rating = None
 
-        # Пересчитываем средний рейтинг
-        all_reviews = manga.reviews.all()
-        total_rating = sum([r.rating for r in all_reviews])
-        manga.Rating = round(total_rating / manga.RatingCount, 2)
-        manga.save()
+            # Сумма, количество, гистограмма и байесовская оценка — атомарными UPDATE
+            record_review_change(manga.id, old_rating, rating)
 
         serializer.instance = review
 
 
-class MangaReviewsView(generics.ListAPIView): # GET список отзывов
-   # pagination_class = BookmarkPagination
+class MangaRatingHistogramView(APIView):
     permission_classes = [AllowAny]
-    serializer_class = ReviewSerializer
 
+    def get(self, request, manga_id):
+        manga = get_object_or_404(
+            Manga.objects.only('id', 'version', 'Updated_at', 'Rating', 'RatingCount', 'Score'), id=manga_id
+        )
+        # Версия манги растёт с каждым отзывом, поэтому годится как ETag и здесь
+        not_modified = manga_not_modified(request, manga)
+        if not_modified is not None:
+            return not_modified
+
+        response_data = {
+            'manga_id': manga.id,
+            'rating': manga.Rating,
+            'rating_count': manga.RatingCount,
+            'score': manga.Score,
+            'histogram': rating_histogram(manga.id),  # число отзывов с оценкой 0, 1, ..., 10
+        }
+        return set_manga_validators(Response(response_data, status=status.HTTP_200_OK), manga)
 
-    def get_queryset(self):
-        manga_id = self.kwargs['manga_id']
-        return Review.objects.filter(manga__id=manga_id)
+
+class MangaReviewsView(APIView): # GET список отзывов
+    permission_classes = [AllowAny]
+    pagination_class = CatalogCursorPagination
+
+    def get(self, request, manga_id):
+        # Курсор по (created_at, id), индекс review_manga_created_idx; автор и тайтл — тем же запросом
+        ordering = REVIEW_SORT_ORDERING.get(request.query_params.get('sort'), '-created_at')
+        queryset = ReviewSerializer.prepare_queryset(Review.objects.filter(manga_id=manga_id))
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request, view=self, ordering=ordering)
+        serializer = ReviewSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class CustomUserCreate(APIView): # POST создать юзера
@@ -663,64 +1018,61 @@ class LogoutAPIView(APIView):# POST разалогинить юзера
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MangaTitleSearchView(APIView):
+class MangaSearchView(APIView):
     permission_classes = [AllowAny]
     pagination_class = TitlePagination
+    search_field = None  # None — полнотекстовый поиск по всем полям
+
     def post(self, request, *args, **kwargs):
         query = request.data.get('query', None)
+        if not query:
+            return Response({"error": "No query parameter provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if query:
-            # Поиск по тайтлу, автору и художнику
-            mangas = Manga.objects.filter(
-                Q(Title__icontains=query),Moderation_status='approved'
-            ).distinct()
+        field = self.search_field or request.data.get('field')
+        if field is not None and field not in SEARCH_FIELDS:
+            return Response({"error": "Invalid field value."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Сериализация и возврат данных
-            serializer = MangaSerializer(mangas, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            return Response({"error": "No query parameter provided"}, status=status.HTTP_400_BAD_REQUEST)
+        # Ранжированный поиск (PostgreSQL) или подстрочный (SQLite)
+        mangas = search_manga(Manga.objects.filter(Moderation_status='approved'), query, field)
+        mangas = MangaCardSerializer.prepare_queryset(mangas)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(mangas, request, view=self)
+        serializer = MangaCardSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
-class MangaAuthorSearchView(APIView):
+class SuggestView(APIView):
     permission_classes = [AllowAny]
-    pagination_class = TitlePagination
-    def post(self, request, *args, **kwargs):
-        query = request.data.get('query', None)
+    default_limit = 10
+    max_limit = 20
 
-        if query:
-            # Поиск по тайтлу, автору и художнику
-            mangas = Manga.objects.filter(
-                Q(Author__icontains=query),Moderation_status='approved'
-            ).distinct()
+    def get(self, request):
+        # Подсказки для автодополнения из индекса в памяти, без запросов к БД
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
 
-            # Сериализация и возврат данных
-            serializer = MangaSerializer(mangas, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            return Response({"error": "No query parameter provided"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(suggest_index.search(query, max(limit, 1)), status=status.HTTP_200_OK)
 
 
-class MangaPublisherSearchView(APIView):
-    permission_classes = [AllowAny]
-    pagination_class = TitlePagination
-    def post(self, request, *args, **kwargs):
-        query = request.data.get('query', None)
+class MangaTitleSearchView(MangaSearchView):
+    search_field = 'title'
 
-        if query:
-            mangas = Manga.objects.filter(
-                Q(Publisher__icontains=query),Moderation_status='approved'
-            ).distinct()
 
-            serializer = MangaSerializer(mangas, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            return Response({"error": "No query parameter provided"}, status=status.HTTP_400_BAD_REQUEST)
+class MangaAuthorSearchView(MangaSearchView):
+    search_field = 'author'
+
+
+class MangaPublisherSearchView(MangaSearchView):
+    search_field = 'publisher'
 
 
 class PopularMangaView(APIView):
 
-    serializer_class = MangaSerializer
+    serializer_class = MangaCardSerializer
     permission_classes = [AllowAny]
 
     def get(self, request):
@@ -728,6 +1080,11 @@ class PopularMangaView(APIView):
         tags = request.query_params.getlist('tags', [])  # список тегов
         time_filter = request.query_params.get('time_filter')  # фильтр по времени
 
+        # Ответ кешируется по (теги, фильтр времени) и версии каталога
+        data = cached_feed('popular', tags, time_filter, lambda: self.build_feed(tags, time_filter))
+        return Response(data, status=status.HTTP_200_OK)
+
+    def build_feed(self, tags, time_filter):
         # Получаем начальный queryset для манги
         queryset = Manga.objects.all().filter(Moderation_status='approved')
 
@@ -745,20 +1102,19 @@ class PopularMangaView(APIView):
         elif time_filter == 'year':
             queryset = queryset.filter(Created_at__gte=datetime.now() - timedelta(days=365))
 
-        # Сортировка по количеству отзывов и рейтингу
-        queryset = queryset.order_by('-RatingCount', '-Rating')[:6]
+        # Сортировка по сохранённой байесовской оценке (индекс manga_approved_score_idx)
+        queryset = self.serializer_class.prepare_queryset(queryset.order_by('-Score', '-id')[:6])
 
         # Сериализация данных
         manga_serializer = self.serializer_class(queryset, many=True)
 
-        # Возвращаем результат
-        return Response({
+        return {
             'manga': manga_serializer.data,
-        }, status=status.HTTP_200_OK)
+        }
 
 
 class NewReleasesView(APIView):
-    serializer_class = MangaSerializer
+    serializer_class = MangaCardSerializer
     permission_classes = [AllowAny]
 
     def get(self, request):
@@ -766,6 +1122,11 @@ class NewReleasesView(APIView):
         tags = request.query_params.getlist('tags', [])  # список тегов
         time_filter = request.query_params.get('time_filter')  # фильтр по времени
 
+        # Ответ кешируется по (теги, фильтр времени) и версии каталога
+        data = cached_feed('new_releases', tags, time_filter, lambda: self.build_feed(tags, time_filter))
+        return Response(data, status=status.HTTP_200_OK)
+
+    def build_feed(self, tags, time_filter):
         # Получаем начальный queryset для манги
         queryset = Manga.objects.all().filter(Moderation_status='approved')
 
@@ -784,19 +1145,18 @@ class NewReleasesView(APIView):
             queryset = queryset.filter(Created_at__gte=datetime.now() - timedelta(days=365))
 
         # Сортировка по дате создания
-        queryset = queryset.order_by('-Created_at')[:6]
+        queryset = self.serializer_class.prepare_queryset(queryset.order_by('-Created_at')[:6])
 
         # Сериализация данных
         manga_serializer = self.serializer_class(queryset, many=True)
 
-        # Возвращаем результат
-        return Response({
+        return {
             'manga': manga_serializer.data,
-        }, status=status.HTTP_200_OK)
+        }
 
 
 class AllPopularMangaView(APIView):
-    serializer_class = MangaSerializer
+    serializer_class = MangaCardSerializer
     pagination_class = CatalogPagination
     permission_classes = [AllowAny]
 
@@ -822,8 +1182,8 @@ class AllPopularMangaView(APIView):
         elif time_filter == 'year':
             queryset = queryset.filter(Created_at__gte=datetime.now() - timedelta(days=365))
 
-        # Сортировка по количеству отзывов и рейтингу
-        queryset = queryset.order_by('-RatingCount', '-Rating')[:100]
+        # Сортировка по сохранённой байесовской оценке (индекс manga_approved_score_idx)
+        queryset = self.serializer_class.prepare_queryset(queryset.order_by('-Score', '-id')[:100])
 
         # Получаем все категории (теги)
 
@@ -836,6 +1196,13 @@ class AllPopularMangaView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+class FeedCacheStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return Response(feed_cache_stats(), status=status.HTTP_200_OK)
+
+
 class CategoryListView(ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -854,6 +1221,8 @@ class PersonCreateView(APIView):
             Person = serializer.save()
             person_dir = os.path.join('media/Persons', Person.Nickname)
             os.makedirs(person_dir, exist_ok=True)
+            if 'profile_image' in request.FILES:
+                generate_variants(Person.profile_image.name, settings.COVER_VARIANT_WIDTHS)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -908,6 +1277,10 @@ class ArtistListView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+def media_file(request, path):
+    # Медиа-файлы с ETag, Cache-Control и поддержкой Range; для изображений доступен ?w=
+    return serve_image(request, path)
+
 
 def index(request):
     return render(request,'index.html')
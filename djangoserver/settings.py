@@ -28,6 +28,61 @@ MANGA_MEDIA_ROOT = os.path.join(MEDIA_ROOT, 'Manga')
 # Path for storing Persons files in the 'Persons' directory
 PERSON_MEDIA_ROOT = os.path.join(MEDIA_ROOT, 'Persons')
 
+# How page images and avatars are delivered:
+# 'inline' - streamed by Django itself;
+# 'nginx'  - X-Accel-Redirect to FILE_DELIVERY_NGINX_PREFIX (an `internal` location aliased to MEDIA_ROOT);
+# 'apache' - X-Sendfile with the absolute path (mod_xsendfile)
+FILE_DELIVERY_BACKEND = os.environ.get('FILE_DELIVERY_BACKEND', 'inline')
+FILE_DELIVERY_NGINX_PREFIX = '/protected-media/'
+
+# Cache lifetime for versioned media URLs (?v=<content hash prefix>), which are served as immutable
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Image derivatives generated at ingest time (MangaLib/images.py), served via ?w= and Accept negotiation
+COVER_VARIANT_WIDTHS = (160, 320, 480)
+PAGE_VARIANT_WIDTHS = (720, 1080, 1440)
+IMAGE_VARIANT_FORMATS = ('webp', 'jpeg')
+IMAGE_VARIANT_QUALITY = 82
+
+# Chapter archive ingest: copy buffer and limits enforced while streaming (zip-bomb protection)
+CHAPTER_INGEST_BUFFER_SIZE = 64 * 1024
+CHAPTER_ZIP_MAX_ENTRIES = 2000
+CHAPTER_ZIP_MAX_ENTRY_SIZE = 50 * 1024 * 1024
+CHAPTER_ZIP_MAX_TOTAL_SIZE = 2 * 1024 * 1024 * 1024
+CHAPTER_ZIP_MAX_RATIO = 100
+CHAPTER_INGEST_BATCH_SIZE = 200
+
+# Page validation (MangaLib/pages.py): every page is decoded, rotated by EXIF and stripped of metadata
+# in a process pool; CHAPTER_PAGE_WORKERS = 1 processes pages in the calling process.
+# CHAPTER_PAGE_REENCODE re-encodes every page as JPEG with CHAPTER_PAGE_QUALITY.
+CHAPTER_PAGE_WORKERS = int(os.environ.get('CHAPTER_PAGE_WORKERS', os.cpu_count() or 1))
+CHAPTER_PAGE_REENCODE = False
+CHAPTER_PAGE_QUALITY = 90
+CHAPTER_PAGE_MAX_PIXELS = 40_000_000
+
+# Background chapter ingest (manage.py run_ingest_worker): uploaded archives wait here, outside MEDIA_ROOT
+INGEST_UPLOAD_ROOT = os.path.join(BASE_DIR, 'ingest_uploads')
+INGEST_WORKER_POLL_INTERVAL = 2
+INGEST_PROGRESS_INTERVAL = 10  # pages between progress updates
+INGEST_HEARTBEAT_INTERVAL = 30  # seconds between heartbeats while a job is staging or processing pages
+INGEST_JOB_STALE_AFTER = 10 * 60  # a running job without heartbeat for this long is requeued
+
+# Resumable chunked uploads (MangaLib/uploads.py); the assembled archive is queued as an ingest job
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+CHUNKED_UPLOAD_SESSION_TTL = 24 * 60 * 60  # open sessions idle this long are removed by manage.py purge_upload_sessions
+
+# Bayesian score used by the popularity lists (Manga.Score): every title starts with
+# RATING_PRIOR_WEIGHT virtual reviews of RATING_PRIOR_MEAN. Changing them requires manage.py rebuild_ratings.
+RATING_PRIOR_MEAN = 7.0
+RATING_PRIOR_WEIGHT = 10
+
+# Maximum number of manga ids in each list of a batch bookmark request (api/manga/bookmarks/batch/)
+BOOKMARK_BATCH_MAX_SIZE = 500
+
+# Maximum number of manga ids per /api/me/state/ request (one catalog page)
+ME_STATE_MAX_IDS = 100
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
@@ -48,6 +103,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'MangaLib.apps.MangalibConfig',
@@ -122,6 +178,36 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Работает без внешних сервисов. Кеш у каждого процесса свой, но ленты ключуются версией
+# каталога из БД (MangaLib.models.CatalogVersion), поэтому запись в одном воркере
+# сразу делает устаревшими записи во всех остальных.
+# 'media' — хеши файлов для ETag, отдельно, чтобы не вытеснять ленты
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mangalib',
+    },
+    'media': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mangalib-media',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Время жизни хешей файлов для ETag (секунды); ключ включает mtime и размер файла
+MEDIA_ETAG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Время жизни закешированных лент главной страницы (секунды).
+# Инвалидация идёт через версию каталога, TTL лишь ограничивает устаревание фильтров по времени
+FEED_CACHE_TIMEOUT = 60 * 5
+
+# Как часто (секунды) индекс подсказок пересобирается целиком, чтобы подхватить
+# изменения, сделанные другими процессами
+SUGGEST_INDEX_TTL = 60 * 10
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -1,3 +1,5 @@
+import re
+
 from django.contrib import admin
 from django.urls import path, re_path
 from django.conf import settings
@@ -21,6 +23,7 @@ urlpatterns = [
     path('api/user/publications/manga/',UserMangaPublications.as_view(),name ='user manga publications'),
     path('api/user/publications/persons/', UserPersonsPublications.as_view(), name='user persons publications'),
     path('api/user/delete/', DeleteUserView.as_view(), name='delete-user'),
+    path('api/me/state/', MyMangaStateView.as_view(), name='my-manga-state'),
 
 
     path('api/news/', NewsListView.as_view(), name='news-list'),
@@ -35,14 +38,24 @@ urlpatterns = [
     path('api/manga/<int:pk>/update/', MangaUpdateView.as_view(), name='manga-update'),
     path('api/manga/add_favourite/', AddFavouriteView.as_view(), name='manga-favourite'),
     path('api/manga/add_bookmark/', AddBookmarkView.as_view(), name='manga-bookmark'),
+    path('api/manga/bookmarks/batch/', BookmarkBatchView.as_view(), name='manga-bookmark-batch'),
     path('api/manga/<int:manga_id>/add_review/', AddOrUpdateReviewView.as_view(), name='add_or_update_review'),
     path('api/manga/<int:manga_id>/reviews/', MangaReviewsView.as_view(), name='manga-reviews'),
+    path('api/manga/<int:manga_id>/rating_histogram/', MangaRatingHistogramView.as_view(), name='manga-rating-histogram'),
     path('api/upload_manga/<int:manga_id>/', MangaUploadView.as_view(), name='upload_manga'),
+    path('api/ingest_jobs/<int:job_id>/', IngestJobStatusView.as_view(), name='ingest-job-status'),
+    path('api/upload_manga/<int:manga_id>/sessions/', UploadSessionCreateView.as_view(), name='upload-session-create'),
+    path('api/upload_sessions/<int:session_id>/', UploadSessionView.as_view(), name='upload-session'),
+    path('api/upload_sessions/<int:session_id>/chunks/<int:index>/', UploadChunkView.as_view(),
+         name='upload-session-chunk'),
+    path('api/upload_sessions/<int:session_id>/finalize/', UploadSessionFinalizeView.as_view(),
+         name='upload-session-finalize'),
 
     path('api/popular_manga/', AllPopularMangaView.as_view(), name='popular page'),
     path('api/popular/', PopularMangaView.as_view(), name='popular on main page'),
     path('api/new/', NewReleasesView.as_view(), name='new on main page'),
     path('api/catalog/', CatalogListView.as_view(), name='catalog page'),
+    path('api/cache/stats/', FeedCacheStatsView.as_view(), name='feed cache stats'),
 
     path('api/tags/', CategoryListView.as_view(), name='tags-list'),
     path('api/statuses/', StatusListView.as_view(), name='status-list'),
@@ -56,6 +69,8 @@ urlpatterns = [
     path('api/logout/', LogoutAPIView.as_view(), name='logout'),
     path('api/login/', CustomUserLogin.as_view(), name='user-login'),
 
+    path('search/', MangaSearchView.as_view(), name='manga search'),
+    path('api/search/suggest/', SuggestView.as_view(), name='search suggest'),
     path('search/title/', MangaTitleSearchView.as_view(), name='title search'),
     path('search/author/', MangaAuthorSearchView.as_view(), name='author search'),
     path('search/publisher/', MangaPublisherSearchView.as_view(), name='publisher search'),
@@ -66,6 +81,8 @@ urlpatterns = [
 
 
     path('api/manga/<int:manga_id>/volumes/', MangaVolumesAndChaptersView.as_view(), name='manga-volumes-and-chapters'),
+    path('api/manga/<int:manga_id>/chapters/<int:volume>/<str:chapter_title>/manifest/', ChapterManifestView.as_view(),
+         name='chapter-manifest'),
     path('manga_read/<int:manga_id>/', MangaPageDetailView.as_view(), name='manga-page-detail'),
 
     path('api/get_token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -73,7 +90,7 @@ urlpatterns = [
     path('api/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
 
 
-    *static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT),
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_file, name='media'),
     *static(settings.STATIC_URL, document_root=settings.STATIC_ROOT),
 
     path('', index, name='index'),